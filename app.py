@@ -1,39 +1,173 @@
 # app.py
-import os
 import time
+
+# Startup phases are timed from here, before any other import
+STARTUP_BEGAN = time.perf_counter()
+
+import os
 import json
+import hashlib
+import random
+import mmap
+import struct
+import tempfile
+import glob
+import sqlite3
+import sys
+import zlib
 import logging
 import requests
 import uuid
 import re
-from urllib.parse import urlparse, urljoin
-from typing import Dict, List, Any, Optional, Set
+import heapq
+import itertools
+import threading
+import asyncio
+import functools
+import bisect
+import fnmatch
+import difflib
+import multiprocessing
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from urllib.parse import urlparse, urljoin, urlunparse, parse_qsl, urlencode
+from xml.etree import ElementTree
+from typing import Dict, List, Any, Optional, Set, Tuple, Iterator
 import datetime
 
-import nltk
-from nltk.tokenize import sent_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-from bs4 import BeautifulSoup
+# scikit-learn, numpy and BeautifulSoup are imported where they are first needed, so the
+# server starts (and answers /health) without paying for them
 
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Depends, HTTPException, Form
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Depends, HTTPException, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
 from dotenv import load_dotenv
 
-# Hard-coded website URL
-WEBSITE_URL = "https://staging-31ef-vicecards.wpcomstaging.com/"
+IMPORTS_DONE = time.perf_counter()
+
 MAX_SCAN_DEPTH = 3  # Depth for recursive scanning
 MAX_SCAN_PAGES = 200  # Maximum number of pages to scan
 
 # Load environment variables
 load_dotenv()
 
+# Website served when no SITES_FILE is configured
+WEBSITE_URL = os.getenv("WEBSITE_URL", "https://staging-31ef-vicecards.wpcomstaging.com/")
+
+# Multi-tenant settings: one process can serve every site listed in SITES_FILE, a JSON list of
+# {"site_id": ..., "url": ..., "api_key": ...} objects. Requests pick a site by API key or site id
+SITES_FILE = os.getenv("SITES_FILE")
+DEFAULT_SITE_ID = "default"
+MAX_LOADED_SITES = int(os.getenv("MAX_LOADED_SITES", 50))  # Sites kept in memory (LRU beyond that)
+CRAWL_MAX_CONCURRENT_SITES = int(os.getenv("CRAWL_MAX_CONCURRENT_SITES", 2))  # Sites crawled at the same time
+
+# Crawler settings
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 8))  # Pages fetched in parallel during a scan
+CRAWL_PER_HOST_LIMIT = int(os.getenv("CRAWL_PER_HOST_LIMIT", 4))  # Max in-flight requests to a single host
+CRAWL_REQUEST_TIMEOUT = 15  # Seconds per page request
+# Processes that parse crawled pages and extract their text while the crawler threads keep downloading
+# (1 or less parses on the crawler threads instead). Defaults to the CPUs this process may run on
+CRAWL_PARSE_WORKERS = int(os.getenv("CRAWL_PARSE_WORKERS", len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity")
+                                    else os.cpu_count() or 1))
+
+# Content discovery: "auto" pulls WordPress pages and posts in bulk from the REST API, and otherwise
+# seeds the HTML crawl from the sitemap; "links" only follows <a> links from the website URL
+CRAWL_DISCOVERY = os.getenv("CRAWL_DISCOVERY", "auto").lower()
+WP_API_TYPES = ['pages', 'posts']  # Pages first: they hold the about/FAQ/contact content
+WP_API_PAGE_SIZE = 100  # Items per REST API request (the API maximum)
+SITEMAP_PATHS = ['sitemap.xml', 'wp-sitemap.xml', 'sitemap_index.xml']  # Tried when robots.txt lists none
+SITEMAP_MAX_FILES = 50  # Sitemap files read per scan, including those of a sitemap index
+
+# URL canonicalization: query parameters that never change the page content are dropped (comma-separated,
+# * wildcards allowed). If CANONICAL_KEEP_PARAMS is set, every parameter not listed there is dropped instead
+CANONICAL_DROP_PARAMS = [param.strip().lower() for param in os.getenv(
+    "CANONICAL_DROP_PARAMS",
+    "utm_*,fbclid,gclid,msclkid,mc_cid,mc_eid,_ga,_gl,replytocom,cpage,share,amp,phpsessid,sessionid"
+).split(',') if param.strip()]
+CANONICAL_KEEP_PARAMS = [param.strip().lower() for param in os.getenv("CANONICAL_KEEP_PARAMS", "").split(',')
+                         if param.strip()]
+
+# Browser-like headers used for every crawler request
+CRAWL_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Cache-Control': 'max-age=0'
+}
+
+# On-disk crawl snapshots, used for warm restarts
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", ".chatbot_cache")
+SNAPSHOT_MAGIC = b"CHATSNAP"
+SNAPSHOT_VERSION = 2  # Bump whenever the snapshot payload layout or section text format changes
+SNAPSHOT_HEADER = struct.Struct("<8sHI")  # magic, version, header length
+
+# Shared-state mode, for several workers on one machine (uvicorn --workers N): one worker crawls,
+# every worker loads the context from the snapshot, and sessions live in a shared SQLite database
+SHARED_STATE = os.getenv("SHARED_STATE", "false").lower() in ("1", "true", "yes")
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", os.path.join(SNAPSHOT_DIR, "state.db"))
+SHARED_STATE_POLL_INTERVAL = float(os.getenv("SHARED_STATE_POLL_INTERVAL", 5))  # Seconds between snapshot checks
+# Set to false when a separate job crawls (python app.py crawl) and the workers only serve
+CRAWLER_ENABLED = os.getenv("CRAWLER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Cross-page deduplication settings
+BOILERPLATE_MIN_PAGES = 3  # A block repeated on at least this many pages...
+BOILERPLATE_PAGE_RATIO = 0.3  # ...and on at least this share of pages is site-wide boilerplate
+NEAR_DUPLICATE_MAX_DISTANCE = 3  # Max differing SimHash bits for two pages to count as near-duplicates
+
+# Retrieval settings: each query only gets the most relevant chunks of the website
+RETRIEVAL_CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", 150))  # Words per indexed chunk
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 6))  # Max chunks added to a query prompt
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", 3000))  # Max website tokens added to a query prompt
+
+# Token budget of the full-site context prompt, filled with the priority pages first
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 30000))
+PRIORITY_PAGE_PATTERNS = ['about', 'faq', 'contact']
+
+# Gemini settings
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+# Lower temperatures give more controlled responses: careful and empathetic for frustrated users,
+# detailed for curious users, direct and concise for urgent queries
+SENTIMENT_TEMPERATURES = {
+    "neutral": 0.7, "happy": 0.7, "confused": 0.7,
+    "frustrated": 0.4, "curious": 0.5, "urgent": 0.3
+}
+
+# LLM backend: "gemini" calls the Gemini API, "mock" is a local stand-in for load tests and benchmarks
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+MOCK_LLM_LATENCY = float(os.getenv("MOCK_LLM_LATENCY", 0.5))  # Seconds before the first token
+MOCK_LLM_TOKENS_PER_SEC = float(os.getenv("MOCK_LLM_TOKENS_PER_SEC", 50))  # Output throughput, 0 for no delay
+MOCK_LLM_ERROR_RATE = float(os.getenv("MOCK_LLM_ERROR_RATE", 0.0))  # Fraction of calls that fail
+MOCK_LLM_RESPONSE_TOKENS = int(os.getenv("MOCK_LLM_RESPONSE_TOKENS", 120))  # Approximate length of mock replies
+MOCK_LLM_SEED = int(os.getenv("MOCK_LLM_SEED", 0))  # Seed for the simulated failures
+
+# Query pipeline settings: blocking work runs on a bounded pool so the event loop stays responsive
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", 16))  # Queries processed at the same time
+QUERY_QUEUE_LIMIT = int(os.getenv("QUERY_QUEUE_LIMIT", 64))  # Queries allowed to wait before new ones are rejected
+
+# Answer cache settings: repeated questions are answered without calling Gemini
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 500))  # Cached answers (LRU beyond that)
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 24 * 60 * 60))  # Seconds a cached answer stays valid
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.85))  # Min cosine similarity for near-duplicates
+
+# Conversation session settings
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", 10000))  # Live sessions kept in memory (LRU beyond that)
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", 2 * 60 * 60))  # Seconds, matches the widget's 2 hour conversations
+SESSION_HISTORY_LENGTH = 20  # Exchanges kept per session
+SESSION_MAX_MESSAGE_CHARS = 4000  # Longer queries/responses are truncated in the history
+
+# Common important page patterns to crawl first
+IMPORTANT_PAGE_PATTERNS = [
+    '/about', '/about-us', '/contact', '/faq',
+    '/products', '/services', '/company'
+]
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -50,11 +184,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Download NLTK resources at startup
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
-nltk.download('punkt_tab')  # Also download punkt_tab which is needed for tokenization
+# Cold start until the app is ready to serve requests should stay within this many seconds
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", 2.0))
 
 # EmailJS credentials
 EMAILJS_SERVICE_ID = 'service_3jl7kuy'
@@ -62,337 +193,1164 @@ EMAILJS_TEMPLATE_ID = 'template_hiuxjep'
 EMAILJS_PUBLIC_KEY = 'yBoW6wqsMfU5ftCfY'
 EMAILJS_URL = 'https://api.emailjs.com/api/v1.0/email/send'
 
+# Escalation emails are queued and delivered by background workers, with retries
+EMAIL_QUEUE_FILE = os.getenv("EMAIL_QUEUE_FILE", os.path.join(SNAPSHOT_DIR, "email_queue.json"))
+EMAIL_QUEUE_WORKERS = int(os.getenv("EMAIL_QUEUE_WORKERS", 2))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 6))  # Attempts before a job is dead-lettered
+EMAIL_RETRY_BASE_DELAY = float(os.getenv("EMAIL_RETRY_BASE_DELAY", 2.0))  # Seconds, doubled after each failure
+EMAIL_RETRY_MAX_DELAY = float(os.getenv("EMAIL_RETRY_MAX_DELAY", 300.0))
+EMAIL_REQUEST_TIMEOUT = 20
+
 # Initialize Google Gemini API
 gemini_api_key = os.getenv("GEMINI_API_KEY")
-if not gemini_api_key:
+if not gemini_api_key and LLM_BACKEND == "gemini":
     logger.warning("GEMINI_API_KEY not found in environment variables")
 
 
 # Pydantic models for API validation
 class Query(BaseModel):
     query: str
+    conversation_id: Optional[str] = None
+    site_id: Optional[str] = None
 
 
-class WebsiteScanner:
-    def __init__(self):
-        self.stop_words = set(stopwords.words('english'))
-        self.lemmatizer = WordNetLemmatizer()
-        self.website_content = {}  # Cache for website content
-        self.website_sections = {}  # Cache for website sections
-        self.context_prompt = {}  # Cache for generated context prompts
-        self.last_scan_time = {}  # Store last scan time for each URL
-        self.context_expiry_time = 72 * 60 * 60  # 72 hours in seconds
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English text (about 4 characters per token)"""
+    return (len(text) + 3) // 4
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
 
-    def extract_text_from_url(self, url: str) -> tuple:
-        """Extract text content from a URL"""
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Unix time of an ISO 8601 date or datetime (as in sitemaps and the WordPress API), assuming UTC if no offset"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def simhash(text: str, shingle_words: int = 3) -> int:
+    """64-bit SimHash of the word shingles of a text; similar texts differ in few bits"""
+    import numpy as np
+
+    words = text.lower().split()
+    shingle_hashes = np.array([_hash64(' '.join(words[i:i + shingle_words]))
+                               for i in range(max(len(words) - shingle_words, 0) + 1)], dtype=np.uint64)
+    # One row of 64 bits per shingle; each bit of the fingerprint is the majority vote of its column
+    bits = np.unpackbits(shingle_hashes.view(np.uint8).reshape(-1, 8), axis=1)
+    majority = bits.sum(axis=0) * 2 > len(shingle_hashes)
+    return int.from_bytes(np.packbits(majority).tobytes(), 'big')
+
+
+class Metrics:
+    """Process-wide counters and histograms, rendered in the Prometheus text format by /metrics.
+
+    Recording is a dict update and a bisect under one lock, cheap enough to leave on in production.
+    Values owned by other objects (open WebSockets, queue depth, ...) are read by callbacks at render time.
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metadata = {}  # Metric name -> (type, help text), in registration order
+        self._buckets = {}  # Histogram name -> upper bounds
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [per-bucket counts (last is +Inf), sum, count]
+        self._callbacks = {}  # Metric name -> function returning a value or a list of (labels, value)
+
+    def counter(self, name: str, help_text: str):
+        self._metadata[name] = ("counter", help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self._metadata[name] = ("histogram", help_text)
+        self._buckets[name] = tuple(sorted(buckets))
+
+    def callback(self, name: str, metric_type: str, help_text: str, func):
+        self._metadata[name] = (metric_type, help_text)
+        self._callbacks[name] = func
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self._buckets[name]
+        index = bisect.bisect_left(buckets, value)  # First bucket whose upper bound is >= value
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Observe the duration of the block in seconds"""
+        start = time.perf_counter()
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Cache-Control': 'max-age=0'
-            }
-            response = requests.get(url, headers=headers, timeout=15)
-            response.raise_for_status()
-
-            # Create BeautifulSoup object with the HTML parser explicitly specified
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Store original full HTML for link extraction
-            full_soup = BeautifulSoup(response.text, 'html.parser')  # Create a fresh copy instead of using .copy()
-
-            # First, remove elements that usually contain non-content
-            for selector in [
-                'script', 'style', 'noscript', 'iframe', 'img', 'svg',
-                '[class*="footer"]', '[class*="sidebar"]', '[class*="widget"]',
-                '[class*="banner"]', '[class*="ad-"]', '[id*="ad-"]'
-            ]:
-                for element in soup.select(selector):
-                    if element:
-                        element.decompose()
-
-            # Find the main content area if it exists
-            main_content = None
-            main_selectors = [
-                'main', 'article', '[role="main"]', '.content', '#content',
-                '.main', '#main', '.post', '.entry', '.page-content',
-                '[class*="content"]', '[id*="content"]'
-            ]
-
-            main_candidates = []
-            for selector in main_selectors:
-                elements = soup.select(selector)
-                if elements:
-                    main_candidates.extend(elements)
-
-            if main_candidates:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _format_labels(labels, extra: Tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{str(value)}"' for key, value in pairs) + "}"
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: [list(value[0]), value[1], value[2]] for key, value in self._histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text) in self._metadata.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if name in self._callbacks:
                 try:
-                    # Try to find the main content with the most text
-                    main_content = max(main_candidates, key=lambda x: len(x.get_text(strip=True) or ""))
-                except (TypeError, ValueError) as e:
-                    # If there's an error finding the main content, continue without it
-                    logger.warning(f"Error finding main content on {url}: {e}")
-                    main_content = None
-
-            # If we found a main content area, use that, otherwise use the whole page
-            if main_content:
-                # Get text from just this section
-                content_soup = main_content
-                logger.info(f"Found main content section on {url}")
+                    value = self._callbacks[name]()
+                except Exception as e:
+                    logger.error(f"Error collecting metric {name}: {e}")
+                    continue
+                samples = value if isinstance(value, list) else [({}, value)]
+                for labels, sample in samples:
+                    lines.append(f"{name}{self._format_labels(sorted(labels.items()))} {sample}")
+            elif metric_type == "counter":
+                for (metric, labels), value in counters.items():
+                    if metric == name:
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
             else:
-                # Remove header/nav/footer before text extraction
-                content_soup = soup
-                for selector in ['header', 'nav', '[class*="nav"]', '[class*="menu"]', '[id*="menu"]']:
-                    for element in content_soup.select(selector):
-                        if element:
-                            element.decompose()
-                logger.info(f"No main content section found, using full page for {url}")
-
-            # Get text with spacing to maintain structure - safely
-            text = ""
-            for tag_name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'li', 'div']:
-                for element in content_soup.find_all(tag_name):
-                    try:
-                        element_text = element.get_text(strip=True)
-                        if element_text:
-                            if tag_name.startswith('h'):
-                                text += f"\n\n{element_text}\n\n"
-                            elif tag_name == 'p':
-                                text += f"{element_text}\n\n"
-                            elif tag_name == 'li':
-                                text += f"• {element_text}\n"
-                            else:
-                                text += f"{element_text} "
-                    except Exception as e:
-                        logger.error(f"Error extracting text from {tag_name} element: {e}")
+                bounds = [str(bound) for bound in self._buckets[name]] + ["+Inf"]
+                for (metric, labels), (bucket_counts, total, count) in histograms.items():
+                    if metric != name:
                         continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(bounds, bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{self._format_labels(labels, (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.histogram("chatbot_crawl_duration_seconds", "Duration of website crawls",
+                  buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+metrics.counter("chatbot_crawl_pages_total", "Pages fetched by the crawler, by outcome")
+metrics.counter("chatbot_crawl_fetches_avoided_total", "Duplicate URLs the crawler did not fetch thanks to canonicalization")
+metrics.histogram("chatbot_extraction_seconds", "Time to extract the text of one page")
+metrics.histogram("chatbot_prompt_tokens", "Estimated size of the prompt sent to the model",
+                  buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+metrics.histogram("chatbot_llm_request_seconds", "Duration of model calls, until the last token")
+metrics.histogram("chatbot_llm_first_token_seconds", "Time from a streaming model call to its first token")
+metrics.counter("chatbot_llm_errors_total", "Failed model calls")
+metrics.counter("chatbot_answer_cache_lookups_total", "Answer cache lookups, by result")
+metrics.histogram("chatbot_response_seconds", "Time to produce a complete chatbot response")
+metrics.counter("chatbot_escalations_total", "Escalation offers and email escalations, by trigger")
+metrics.histogram("chatbot_email_send_seconds", "Duration of EmailJS requests")
+metrics.counter("chatbot_email_failures_total", "Failed EmailJS requests, by reason")
+metrics.counter("chatbot_email_dead_letters_total", "Escalation emails given up on after failed retries")
+
+
+class StartupTimer:
+    """Seconds spent in each startup phase, measured from STARTUP_BEGAN and reported by /health and /metrics"""
+
+    def __init__(self, began: float, budget: float = STARTUP_BUDGET_SECONDS):
+        self.began = began
+        self.budget = budget
+        self.phases: Dict[str, float] = OrderedDict()
+        self.ready_seconds = None  # Until the last startup handler ran
+
+    def record(self, phase: str, since: float, until: Optional[float] = None):
+        self.phases[phase] = round((until or time.perf_counter()) - since, 4)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def mark_ready(self):
+        """Record that startup finished, warning if cold start took longer than the budget"""
+        if self.ready_seconds is not None:
+            return
+        self.ready_seconds = round(time.perf_counter() - self.began, 4)
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        if self.ready_seconds > self.budget:
+            logger.warning(f"Cold start took {self.ready_seconds:.2f}s, over the {self.budget:.2f}s budget ({phases})")
+        else:
+            logger.info(f"Cold start took {self.ready_seconds:.2f}s ({phases})")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"phases": dict(self.phases), "ready_seconds": self.ready_seconds, "budget_seconds": self.budget}
+
+
+startup = StartupTimer(STARTUP_BEGAN)
+startup.record("imports", STARTUP_BEGAN, IMPORTS_DONE)
+metrics.callback("chatbot_startup_seconds", "gauge", "Seconds spent in each startup phase",
+                 lambda: [({"phase": name}, seconds) for name, seconds in startup.phases.items()])
+
+
+class URLCanonicalizer:
+    """Maps the variants of a page URL to one canonical URL, so each page is fetched once.
+
+    Same-site URLs take the scheme and host of the website URL (http/https, www. and default ports
+    are aliases). Fragments, dot segments, repeated slashes, index files and the trailing slash are
+    removed, ignored query parameters are dropped and the rest are sorted. Raw variants are recorded
+    per canonical URL, to report how many fetches canonicalization avoided.
+
+    The canonical URL is only a key: pages are requested at their fetch URL, which keeps the trailing
+    slash of the links and follows redirects, so sites serving `/about/` cost one request per page.
+    """
+
+    DEFAULT_PORTS = {'http': 80, 'https': 443}
+    INDEX_FILE_PATTERN = re.compile(r'/index\.(?:html?|php)$', re.IGNORECASE)
+    ESCAPE_PATTERN = re.compile(r'%[0-9a-f]{2}')
+
+    def __init__(self, base_url: str, drop_params: List[str] = CANONICAL_DROP_PARAMS,
+                 keep_params: List[str] = CANONICAL_KEEP_PARAMS):
+        parsed = urlparse(base_url)
+        self.scheme = parsed.scheme.lower() or 'https'
+        self.netloc = parsed.netloc.lower()
+        self.site = self._site_key(parsed)
+        self.drop_params = drop_params
+        self.keep_params = set(keep_params)
+        self._lock = threading.Lock()
+        self.variants: Dict[str, Set[str]] = {}
+        self.fetch_urls: Dict[str, str] = {}  # Canonical URL -> URL the server serves the page at
+
+    def _site_key(self, parsed) -> Tuple[str, Optional[int]]:
+        """Host without www. and port unless it is not the default, so scheme and www. variants compare equal"""
+        host = (parsed.hostname or '').lower()
+        if host.startswith('www.'):
+            host = host[4:]
+        port = parsed.port
+        return host, None if port == self.DEFAULT_PORTS.get(parsed.scheme.lower()) else port
+
+    def is_internal(self, url: str) -> bool:
+        try:
+            return self._site_key(urlparse(url)) == self.site
+        except ValueError:
+            return False
 
-            # Clean text
-            lines = [line.strip() for line in text.splitlines()]
-            chunks = []
-            for line in lines:
-                line_chunks = [phrase.strip() for phrase in line.split("  ")]
-                chunks.extend(line_chunks)
-            text = ' '.join(chunk for chunk in chunks if chunk)
-
-            # Remove extra spacing
-            text = ' '.join(text.split())
-
-            # Add page title at the beginning for context - safely
-            title = url
-            if soup.title:
-                title_text = soup.title.string
-                if title_text:
-                    title = title_text
-
-            text = f"PAGE TITLE: {title}\n\n{text}"
-
-            # Add any visible meta descriptions - safely
-            meta_desc = soup.find('meta', attrs={'name': 'description'})
-            if meta_desc and meta_desc.has_attr('content'):
-                meta_content = meta_desc['content']
-                if meta_content:
-                    text = f"{text}\n\nMETA DESCRIPTION: {meta_content}"
-
-            return text, full_soup
-        except Exception as e:
-            logger.error(f"Error extracting text from {url}: {e}")
-            return "", None
+    def _keep_param(self, name: str) -> bool:
+        name = name.lower()
+        if self.keep_params:
+            return name in self.keep_params
+        return not any(fnmatch.fnmatchcase(name, pattern) for pattern in self.drop_params)
+
+    @staticmethod
+    def _normalize_path(path: str) -> str:
+        segments = []
+        for segment in re.sub(r'/{2,}', '/', path).split('/'):
+            if segment == '..':
+                if len(segments) > 1:
+                    segments.pop()
+            elif segment != '.':
+                segments.append(segment)
+        return '/'.join(segments)
+
+    def canonicalize(self, url: str) -> str:
+        parsed = urlparse(url.strip())
+        scheme = parsed.scheme.lower()
+        try:
+            internal = self._site_key(parsed) == self.site
+        except ValueError:  # Invalid port
+            internal = False
+        if internal:
+            scheme, netloc = self.scheme, self.netloc
+        else:
+            netloc = parsed.netloc.lower()
+
+        path = self.INDEX_FILE_PATTERN.sub('/', self._normalize_path(parsed.path))
+        path = self.ESCAPE_PATTERN.sub(lambda escape: escape.group(0).upper(), path)
+        params = sorted((name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+                        if self._keep_param(name))
+        canonical = urlunparse((scheme, netloc, path.rstrip('/'), '', urlencode(params), ''))
+        # Remember the slashed form the site links to, so the page isn't requested without it first
+        if internal and path.rstrip('/') and path.endswith('/'):
+            with self._lock:
+                self.fetch_urls.setdefault(canonical, urlunparse((scheme, netloc, path, '', urlencode(params), '')))
+        return canonical
+
+    def fetch_url(self, canonical_url: str) -> str:
+        """The URL to request a page at"""
+        with self._lock:
+            return self.fetch_urls.get(canonical_url, canonical_url)
+
+    def set_fetch_url(self, canonical_url: str, url: str):
+        """Record where the server actually serves a page, e.g. after a redirect"""
+        with self._lock:
+            self.fetch_urls[canonical_url] = url
+
+    def add_variant(self, raw_url: str, canonical_url: str):
+        with self._lock:
+            self.variants.setdefault(canonical_url, set()).add(raw_url)
+
+    def fetches_avoided(self, fetched: Set[str]) -> int:
+        """Extra fetches the raw URL variants of the fetched pages would have cost"""
+        with self._lock:
+            return sum(len(self.variants[url]) - 1 for url in fetched if url in self.variants)
+
+
+class CrawlFrontier:
+    """Priority queue of URLs to crawl: important pages first, then discovery order"""
+
+    def __init__(self, important_patterns: List[str]):
+        self.important_patterns = important_patterns
+        self._heap = []
+        self._seen = set()  # Every URL ever queued, so each page is fetched at most once
+        self._counter = itertools.count()  # Tie-breaker that keeps discovery order stable
+
+    def _priority(self, url: str) -> int:
+        url_lower = url.lower()
+        return 0 if any(pattern in url_lower for pattern in self.important_patterns) else 1
+
+    def push(self, url: str, depth: int) -> bool:
+        """Queue a URL unless it was already seen. Returns True if it was added"""
+        if url in self._seen:
+            return False
+        self._seen.add(url)
+        heapq.heappush(self._heap, (self._priority(url), next(self._counter), url, depth))
+        return True
+
+    def push_seen(self, url: str):
+        """Mark a URL as seen without queuing it, e.g. a page that was already crawled under another URL"""
+        self._seen.add(url)
+
+    def pop(self) -> Tuple[str, int]:
+        """Return the next (url, depth) to crawl"""
+        _, _, url, depth = heapq.heappop(self._heap)
+        return url, depth
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._seen
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class HostLimiter:
+    """Caps the number of concurrent requests sent to each host"""
+
+    def __init__(self, per_host: int):
+        self.per_host = max(1, per_host)
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+
+    @contextmanager
+    def slot(self, url: str):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.Semaphore(self.per_host)
+        with semaphore:
+            yield
+
+
+class RetrievalIndex:
+    """TF-IDF index over fixed-size chunks of the website sections"""
+
+    def __init__(self, sections: List[Dict[str, Any]], chunk_words: int = RETRIEVAL_CHUNK_WORDS):
+        self.chunks = []
+        for section in sections:
+            for text in self._split_into_chunks(section["raw_content"], chunk_words):
+                self.chunks.append({"url": section["url"], "text": text, "tokens": estimate_tokens(text)})
+
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        self.vectorizer = TfidfVectorizer(stop_words='english', sublinear_tf=True)
+        # Sparse (chunks x vocabulary) matrix with L2-normalized rows
+        self.matrix = self.vectorizer.fit_transform([chunk["text"] for chunk in self.chunks])
+
+    @staticmethod
+    def _split_into_chunks(text: str, chunk_words: int) -> List[str]:
+        """Split text into chunks of about chunk_words words, overlapping by a fifth"""
+        words = text.split()
+        step = max(1, chunk_words - chunk_words // 5)
+        starts = list(range(0, max(len(words) - chunk_words, 0) + 1, step))
+        # The last window may stop short of the end of the page; the tail (often contact details) needs a chunk too
+        if starts[-1] + chunk_words < len(words):
+            starts.append(len(words) - chunk_words)
+        return [' '.join(words[i:i + chunk_words]) for i in starts]
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K, max_tokens: int = RETRIEVAL_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+        """Return the chunks most similar to the query, best first, within max_tokens"""
+        if not self.chunks:
+            return []
+
+        import numpy as np
+        from sklearn.metrics.pairwise import cosine_similarity
+        scores = cosine_similarity(self.vectorizer.transform([query]), self.matrix).ravel()
+        candidates = np.argsort(-scores)[:top_k]
+
+        results = []
+        used_tokens = 0
+        for index in candidates:
+            if scores[index] <= 0:
+                break
+            chunk = self.chunks[index]
+            if used_tokens + chunk["tokens"] > max_tokens:
+                continue
+            results.append({**chunk, "score": float(scores[index])})
+            used_tokens += chunk["tokens"]
+
+        return results
+
+
+class HTMLExtractor:
+    """Single-pass extractor for the text and links of a page.
+
+    The page is parsed once and walked once in document order. Text inside headings,
+    paragraphs and list items is emitted once for the outermost such element, and loose
+    text inside divs is emitted once as well, so nested markup never duplicates text.
+    """
+
+    HIDDEN_TAGS = {'script', 'style', 'noscript', 'iframe', 'img', 'svg'}
+    HIDDEN_CLASS_PARTS = ('footer', 'sidebar', 'widget', 'banner', 'ad-')
+    NAV_TAGS = {'header', 'nav'}
+    NAV_CLASS_PARTS = ('nav', 'menu')
+    BLOCK_PREFIXES = {'h1': '', 'h2': '', 'h3': '', 'h4': '', 'h5': '', 'h6': '', 'p': '', 'li': '• '}
+
+    @staticmethod
+    def _main_content_rank(name: str, attrs: Dict[str, Any], classes: List[str], class_str: str,
+                           id_str: str) -> Optional[int]:
+        """Rank of the first main content selector matching this element (lower is preferred), or None"""
+        if name == 'main':
+            return 0
+        if name == 'article':
+            return 1
+        if attrs.get('role') == 'main':
+            return 2
+        if 'content' in classes:
+            return 3
+        if id_str == 'content':
+            return 4
+        if 'main' in classes:
+            return 5
+        if id_str == 'main':
+            return 6
+        if 'post' in classes:
+            return 7
+        if 'entry' in classes:
+            return 8
+        if 'page-content' in classes:
+            return 9
+        if 'content' in class_str:
+            return 10
+        if 'content' in id_str:
+            return 11
+        return None
+
+    def extract(self, html: str, url: str) -> Tuple[str, List[str]]:
+        """Return the structured text of a page and the raw href of every link on it"""
+        text, hrefs, _ = self.extract_page(html, url)
+        return text, hrefs
+
+    def extract_page(self, html: str, url: str) -> Tuple[str, List[str], Optional[str]]:
+        """Like extract, plus the raw href of the page's <link rel="canonical">, if any"""
+        from bs4 import BeautifulSoup, NavigableString, CData
+        text_types = (NavigableString, CData)  # Exact types, so comments and doctypes are skipped
+        soup = BeautifulSoup(html, 'html.parser')
+
+        fragments = []  # (prefix, text, text without navigation) in document order
+        candidates = []  # (text length, -selector rank, -position, first fragment, end fragment)
+        hrefs = []
+        title = None
+        title_seen = False
+        meta_description = None
+        meta_seen = False
+        canonical = None
+        total_chars = 0  # Visible characters seen so far, used to measure main content candidates
+        position = 0
+        block = None  # (prefix, [(text, is_nav)]) of the heading/paragraph/list item being collected
+
+        # Each frame: (tag, children iterator, hidden, nav, in_div, exit info)
+        stack = [(soup, iter(soup.contents), False, False, False, None)]
+        while stack:
+            tag, children, hidden, nav, in_div, exit_info = stack[-1]
+            child = next(children, None)
+
+            if child is None:
+                stack.pop()
+                if exit_info:
+                    rank, start_chars, start_fragment, owns_block = exit_info
+                    if owns_block:
+                        prefix, parts = block
+                        fragments.append((prefix, ' '.join(text for text, _ in parts),
+                                          ' '.join(text for text, is_nav in parts if not is_nav)))
+                        block = None
+                    if rank is not None:
+                        candidates.append((total_chars - start_chars, -rank, -position,
+                                           start_fragment, len(fragments)))
+                continue
+
+            if isinstance(child, NavigableString):
+                if hidden or type(child) not in text_types:
+                    continue
+                text = child.strip()
+                if not text:
+                    continue
+                total_chars += len(text)
+                if block is not None:
+                    block[1].append((text, nav))
+                elif in_div:
+                    fragments.append(('', text, '' if nav else text))
+                continue
 
-    def get_all_links(self, soup: BeautifulSoup, base_url: str) -> Set[str]:
-        """Extract all links from a webpage that belong to the same domain using a simpler approach"""
-        if not soup:
+            name = child.name
+            attrs = child.attrs
+            position += 1
+
+            # Links, title, meta description and canonical URL come from the full page, including hidden parts
+            if name == 'a':
+                href = attrs.get('href')
+                if href is not None:
+                    hrefs.append(href)
+            elif name == 'link' and canonical is None and 'canonical' in (attrs.get('rel') or []):
+                canonical = attrs.get('href')
+            elif name == 'title' and not title_seen:
+                title_seen = True
+                title = child.string
+            elif name == 'meta' and not meta_seen and attrs.get('name') == 'description':
+                meta_seen = True
+                meta_description = attrs.get('content')
+
+            classes = attrs.get('class') or []
+            class_str = ' '.join(classes) if isinstance(classes, list) else classes
+            id_str = attrs.get('id') or ''
+
+            child_hidden = hidden or name in self.HIDDEN_TAGS or 'ad-' in id_str or \
+                any(part in class_str for part in self.HIDDEN_CLASS_PARTS)
+            child_nav = nav or name in self.NAV_TAGS or 'menu' in id_str or \
+                any(part in class_str for part in self.NAV_CLASS_PARTS)
+
+            rank = None
+            owns_block = False
+            if not child_hidden:
+                rank = self._main_content_rank(name, attrs, classes, class_str, id_str)
+                if block is None and name in self.BLOCK_PREFIXES:
+                    block = (self.BLOCK_PREFIXES[name], [])
+                    owns_block = True
+
+            exit_info = (rank, total_chars, len(fragments), owns_block) if rank is not None or owns_block else None
+            stack.append((child, iter(child.contents), child_hidden, child_nav, in_div or name == 'div', exit_info))
+
+        if candidates:
+            # Use the main content area with the most text
+            _, _, _, start, end = max(candidates)
+            texts = [prefix + text for prefix, text, _ in fragments[start:end] if text]
+            logger.info(f"Found main content section on {url}")
+        else:
+            # Use the whole page without header/nav/menus
+            texts = [prefix + text for prefix, _, text in fragments if text]
+            logger.info(f"No main content section found, using full page for {url}")
+
+        # Remove extra spacing, one block (heading, paragraph, list item, div text) per line
+        text = '\n'.join(' '.join(block.split()) for block in texts)
+
+        # Add page title at the beginning for context
+        text = f"PAGE TITLE: {title or url}\n\n{text}"
+
+        # Add any visible meta descriptions
+        if meta_description:
+            text = f"{text}\n\nMETA DESCRIPTION: {meta_description}"
+
+        return text, hrefs, canonical
+
+
+page_extractor = HTMLExtractor()
+
+
+def parse_page(html: str, url: str) -> Dict[str, Any]:
+    """The CPU-bound part of crawling a page: parse the HTML and extract its text and links.
+    Runs in a parse worker process, so it only takes and returns plain data"""
+    start = time.perf_counter()
+    text, hrefs, canonical = page_extractor.extract_page(html, url)
+    return {
+        "text": text,
+        "hrefs": hrefs,
+        "canonical": canonical,
+        "seconds": time.perf_counter() - start
+    }
+
+
+class ParsePool:
+    """Process pool for the parse stage of crawls, shared by every scan and site of the process.
+
+    Crawler threads download pages and hand the HTML over, so parsing uses every core instead of
+    one under the GIL while the downloads go on. Workers are spawned (not forked from the threaded
+    server) on first use. If the pool breaks, pages are parsed on the calling thread.
+    """
+
+    def __init__(self, workers: int = CRAWL_PARSE_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pages_parsed = 0
+        self.pages_inline = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                logger.info(f"Starting {self.workers} parse worker processes")
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def parse(self, html: str, url: str) -> Dict[str, Any]:
+        """Parse a page on a worker process and wait for the result (called from crawler threads)"""
+        result = None
+        if self.workers > 1:
+            executor = self._get_executor()
+            try:
+                result = executor.submit(parse_page, html, url).result()
+                self.pages_parsed += 1
+            except BrokenProcessPool as e:
+                logger.error(f"Parse worker pool failed, restarting it: {e}")
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False)
+
+        if result is None:
+            result = parse_page(html, url)
+            self.pages_inline += 1
+        metrics.observe("chatbot_extraction_seconds", result["seconds"])
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"workers": self.workers, "running": self._executor is not None,
+                "pages_parsed": self.pages_parsed, "pages_inline": self.pages_inline}
+
+
+parse_pool = ParsePool()
+
+
+class WebsiteScanner:
+    def __init__(self):
+        self.website_content = {}  # Cache for website content
+        self.website_sections = {}  # Cache for website sections
+        self.context_prompt = {}  # Cache for generated context prompts
+        self.last_scan_time = {}  # Store last scan time for each URL
+        self.crawl_stats = {}  # Stats of the last crawl for each URL
+        self.page_cache = {}  # Per-page validators and extracted content for incremental re-crawls
+        self.sections_digest = {}  # Fingerprint of the sections behind each cached context prompt
+        self.retrieval_index = {}  # Per-query retrieval index for each URL
+        self.url_aliases = {}  # Canonical URL -> URL the page is known under (its redirect target or canonical tag)
+        self.context_expiry_time = 72 * 60 * 60  # 72 hours in seconds
+        self.host_limiter = HostLimiter(CRAWL_PER_HOST_LIMIT)
+        self.extractor = HTMLExtractor()
+        self.session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        """Create a shared HTTP session so crawler requests reuse keep-alive connections"""
+        session = requests.Session()
+        pool_size = max(CRAWL_CONCURRENCY, CRAWL_PER_HOST_LIMIT, 1)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(CRAWL_HEADERS)
+        return session
+
+    def fetch_page(self, url: str, cached: Optional[Dict[str, Any]] = None) -> requests.Response:
+        """Fetch a page through the pooled session, respecting the per-host limit.
+        If a cached entry is given, the request is conditional and may return 304 Not Modified"""
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers['If-None-Match'] = cached["etag"]
+            if cached.get("last_modified"):
+                headers['If-Modified-Since'] = cached["last_modified"]
+
+        with self.host_limiter.slot(url):
+            response = self.session.get(url, headers=headers, timeout=CRAWL_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response
+
+    def extract_text_from_html(self, html: str, url: str) -> Tuple[str, List[str]]:
+        """Extract text content and raw link targets from the HTML of a page"""
+        text, hrefs, _ = self.extract_page_from_html(html, url)
+        return text, hrefs
+
+    def extract_page_from_html(self, html: str, url: str) -> Tuple[str, List[str], Optional[str]]:
+        """Extract text content, raw link targets and the canonical link from the HTML of a page"""
+        with metrics.time("chatbot_extraction_seconds"):
+            return self.extractor.extract_page(html, url)
+
+    def get_all_links(self, hrefs: List[str], base_url: str,
+                      canonicalizer: Optional[URLCanonicalizer] = None) -> Set[str]:
+        """Resolve the link targets of a webpage to the canonical URLs of pages on the same website"""
+        if not hrefs:
             return set()
 
-        # Get base domain for comparison
+        canonicalizer = canonicalizer or URLCanonicalizer(base_url)
         base_domain = urlparse(base_url).netloc
         links = set()
 
         # Common non-content URL patterns to skip
         skip_patterns = [
             '.jpg', '.jpeg', '.png', '.gif', '.pdf', '.zip', '.doc', '.docx',
-            '#', 'mailto:', 'tel:', 'javascript:',
+            'mailto:', 'tel:', 'javascript:',
             '/tag/', '/category/', '/author/', '/wp-content/', '/wp-admin/'
         ]
 
         # Get all links
         try:
-            for a_tag in soup.find_all('a', href=True):
-                href = a_tag.get('href', '').strip()
+            for href in hrefs:
+                href = href.strip()
 
-                # Skip empty hrefs
-                if not href:
+                # Skip empty hrefs and links within the page
+                if not href or href.startswith('#'):
                     continue
 
                 # Skip unwanted patterns
                 if any(pattern in href.lower() for pattern in skip_patterns):
                     continue
 
-                # Fix double slashes (except after protocol)
-                while '//' in href and not href.startswith('http'):
-                    href = href.replace('//', '/')
-
-                # Make absolute URL
-                if href.startswith('/'):
-                    href = urljoin(base_url, href)
-                elif not href.startswith(('http://', 'https://')):
-                    href = urljoin(base_url, href)
-
-                # Remove trailing slashes for consistency
-                href = href.rstrip('/')
+                # Make absolute URL, then only keep links to the same website
+                absolute = urljoin(base_url, href)
+                if not canonicalizer.is_internal(absolute):
+                    continue
 
-                # Only include links from same domain
-                if urlparse(href).netloc == base_domain:
-                    links.add(href)
+                canonical = canonicalizer.canonicalize(absolute)
+                links.add(canonical)
+                # Without canonicalization, each same-domain variant would have been fetched separately
+                raw = absolute.split('#', 1)[0].rstrip('/')
+                if urlparse(raw).netloc == base_domain:
+                    canonicalizer.add_variant(raw, canonical)
 
             return links
         except Exception as e:
             logger.error(f"Error extracting links from page: {e}")
             return set()
 
-    def preprocess_text(self, text: str) -> str:
-        """Preprocess text by removing stopwords and lemmatizing"""
-        # Convert to lowercase
-        text = text.lower()
-
-        # Tokenize
-        words = text.split()
-
-        # Remove stopwords and lemmatize
-        processed_words = [self.lemmatizer.lemmatize(word) for word in words if word not in self.stop_words]
-
-        return ' '.join(processed_words)
-
-    def split_into_sections(self, text: str, url: str) -> List[Dict[str, Any]]:
-        """Split text into meaningful sections - Simplified version"""
-        # For the simpler approach, we'll just create a single section from the entire page
-        # This avoids the complexity of trying to detect sections and headers
-
-        if not text or len(text.strip()) < 10:
-            return []
-
-        # Create a single section for the entire page
-        return [{
+    def _make_section(self, url: str, page_text: str) -> Dict[str, Any]:
+        """Create a section from the text of a page"""
+        return {
             "title": f"Content from {url}",
-            "content": self.preprocess_text(text),
-            "raw_content": text,
-            "url": url
-        }]
-
-    def scan_website_recursive(self, base_url: str, depth: int = 3, max_pages: int = 50) -> List[Dict[str, Any]]:
-        """Scan website with a simpler, more robust approach"""
-        logger.info(f"Starting website scan: {base_url} (depth: {depth}, max_pages: {max_pages})")
-
-        # Initialize tracking
-        visited = set()  # URLs already processed
-        to_visit = [base_url]  # Queue of URLs to process
-        all_sections = []  # Collected content
-        pages_scanned = 0
+            "raw_content": page_text,
+            "url": url,
+            "tokens": estimate_tokens(page_text)
+        }
 
-        # Common important page patterns to prioritize
-        important_patterns = [
-            '/about', '/about-us', '/contact', '/faq',
-            '/products', '/services', '/company'
-        ]
+    def _crawl_page(self, url: str, canonicalizer: Optional[URLCanonicalizer] = None,
+                    lastmod: Optional[float] = None) -> Tuple[Optional[Dict[str, Any]], Set[str], str]:
+        """Fetch and extract a single page (runs on a crawler worker thread).
+        Returns (section, links, status) where status is one of:
+        "new", "changed", "unchanged", "not_modified" or "failed".
+        The section URL is the canonical URL of the page, which may differ from url after a redirect
+        or when the page has a canonical tag
+        """
+        canonicalizer = canonicalizer or URLCanonicalizer(url)
+        cached = self.page_cache.get(url)
+        # The sitemap says the page has not changed since it was fetched, no request needed
+        if cached and lastmod and cached.get("fetched_at", 0) >= lastmod:
+            return cached["section"], set(cached["links"]), "not_modified"
+
+        # Request the page where it was served last time, not at its canonical URL, to skip the redirect
+        fetch_url = (cached or {}).get("fetch_url") or canonicalizer.fetch_url(url)
+        try:
+            response = self.fetch_page(fetch_url, cached)
+        except Exception as e:
+            logger.error(f"Error extracting text from {url}: {e}")
+            return None, set(), "failed"
+
+        # Served at another URL of the same page (e.g. with a trailing slash): request that one from now on
+        if response.url != fetch_url and canonicalizer.canonicalize(response.url) == url:
+            fetch_url = response.url
+            canonicalizer.set_fetch_url(url, fetch_url)
+            if cached:
+                cached["fetch_url"] = fetch_url
+
+        # Server confirmed the page is unchanged, nothing was downloaded
+        if cached and response.status_code == 304:
+            cached["fetched_at"] = time.time()
+            return cached["section"], set(cached["links"]), "not_modified"
+
+        # Server ignored the validators but the body is identical, skip parsing
+        digest = hashlib.sha1(response.content).hexdigest()
+        if cached and cached["digest"] == digest:
+            cached.update({
+                "etag": response.headers.get('ETag'),
+                "last_modified": response.headers.get('Last-Modified'),
+                "fetched_at": time.time()
+            })
+            return cached["section"], set(cached["links"]), "unchanged"
+
+        # Parsing runs on the parse worker processes; this thread just waits while the others keep downloading
+        parsed = parse_pool.parse(response.text, url)
+        page_text, hrefs, canonical_href = parsed["text"], parsed["hrefs"], parsed["canonical"]
+        if not page_text:
+            return None, set(), "failed"
+
+        # Identify the page by the URL it redirected to, or the URL its canonical tag names
+        page_url = url
+        for candidate in (response.url, urljoin(response.url, canonical_href) if canonical_href else None):
+            if candidate and canonicalizer.is_internal(candidate):
+                page_url = canonicalizer.canonicalize(candidate)
+        if page_url != url:
+            self.url_aliases[url] = page_url
+
+        section = self._make_section(page_url, page_text)
+        links = self.get_all_links(hrefs, response.url, canonicalizer)
+        self.page_cache[url] = {
+            "fetch_url": fetch_url,
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified'),
+            "digest": digest,
+            "section": section,
+            "links": sorted(links),
+            "fetched_at": time.time()
+        }
+        return section, links, "changed" if cached else "new"
+
+    def _get_json(self, url: str, params: Dict[str, Any]) -> requests.Response:
+        """GET a JSON API through the pooled session, respecting the per-host limit"""
+        with self.host_limiter.slot(url):
+            response = self.session.get(url, params=params, headers={'Accept': 'application/json'},
+                                        timeout=CRAWL_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response
+
+    def ingest_wordpress(self, base_url: str, max_pages: int = 50) -> Optional[List[Dict[str, Any]]]:
+        """Pull the bodies of all pages and posts from the WordPress REST API, up to 100 per request.
+        The API returns the content without the theme markup, and its modified time lets unchanged pages
+        be reused without parsing. Returns None if the site has no usable API, so the caller can crawl HTML"""
+        api_url = urljoin(base_url.rstrip('/') + '/', 'wp-json/wp/v2/')
+        canonicalizer = URLCanonicalizer(base_url)
+        start_time = time.time()
+        sections = []
+        api_requests = 0
+        page_statuses = {"new": 0, "changed": 0, "unchanged": 0, "not_modified": 0, "failed": 0}
+
+        for post_type in WP_API_TYPES:
+            page, total_pages = 1, 1
+            while page <= total_pages and len(sections) < max_pages:
+                try:
+                    response = self._get_json(f"{api_url}{post_type}", {
+                        "per_page": WP_API_PAGE_SIZE,
+                        "page": page,
+                        "_fields": "link,modified_gmt,title,content"
+                    })
+                    api_requests += 1
+                    items = response.json()
+                    if not isinstance(items, list):
+                        raise ValueError("unexpected response")
+                except Exception as e:
+                    if not api_requests:
+                        logger.info(f"No WordPress REST API at {api_url} ({e}), crawling HTML instead")
+                        return None
+                    logger.warning(f"Error reading {post_type} page {page} from the WordPress REST API: {e}")
+                    break
+
+                total_pages = int(response.headers.get('X-WP-TotalPages', 1))
+                page += 1
+                for item in items[:max_pages - len(sections)]:
+                    section, status = self._ingest_wordpress_item(item, canonicalizer)
+                    page_statuses[status] += 1
+                    if section:
+                        sections.append(section)
+
+        self._record_crawl_stats(base_url, "wordpress", len(sections) + page_statuses["failed"], page_statuses,
+                                 sections, time.time() - start_time, request_count=api_requests)
+        if not sections:
+            logger.warning(f"The WordPress REST API of {base_url} returned no content, crawling HTML instead")
+            return None
+        return sections
+
+    def _ingest_wordpress_item(self, item: Dict[str, Any],
+                               canonicalizer: URLCanonicalizer) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Turn a page or post of the WordPress REST API into a section, reusing it if it was not modified"""
+        url = canonicalizer.canonicalize(item["link"]) if item.get("link") else None
+        content = (item.get("content") or {}).get("rendered")
+        if not url or not content:
+            return None, "failed"
+
+        modified = item.get("modified_gmt")
+        cached = self.page_cache.get(url)
+        if cached and modified and cached.get("modified") == modified:
+            cached["fetched_at"] = time.time()
+            return cached["section"], "not_modified"
+
+        title = (item.get("title") or {}).get("rendered", "")
+        page_text, _ = self.extract_text_from_html(
+            f"<html><head><title>{title}</title></head><body><main>{content}</main></body></html>", url)
+        if not page_text:
+            return None, "failed"
+
+        section = self._make_section(url, page_text)
+        self.page_cache[url] = {
+            "etag": None,
+            "last_modified": None,
+            "modified": modified,
+            "digest": None,
+            "section": section,
+            "links": [],
+            "fetched_at": time.time()
+        }
+        return section, "changed" if cached else "new"
+
+    def read_sitemap(self, base_url: str, max_urls: int = 1000) -> Dict[str, Optional[float]]:
+        """URLs under base_url listed in the website's sitemap (from robots.txt or the usual locations),
+        mapped to their lastmod time if given. Sitemap indexes are followed.
+        The URLs are returned as listed (e.g. with their trailing slash), the crawler canonicalizes them"""
+        root_url = urljoin(base_url, '/')
+        canonicalizer = URLCanonicalizer(base_url)
+        prefix = canonicalizer.canonicalize(base_url)
+        candidates = []
+        try:
+            robots = self.fetch_page(urljoin(root_url, 'robots.txt'))
+            candidates = [line.split(':', 1)[1].strip() for line in robots.text.splitlines()
+                          if line.lower().startswith('sitemap:')]
+        except Exception:
+            pass
+        candidates += [urljoin(root_url, path) for path in SITEMAP_PATHS if urljoin(root_url, path) not in candidates]
+
+        urls = {}
+        files_read = 0
+        for candidate in candidates:
+            pending = deque([candidate])
+            while pending and files_read < SITEMAP_MAX_FILES and len(urls) < max_urls:
+                sitemap_url = pending.popleft()
+                files_read += 1
+                try:
+                    tree = ElementTree.fromstring(self.fetch_page(sitemap_url).content)
+                except Exception:
+                    continue
 
-        # Reorder the to_visit list to prioritize important URLs
-        def prioritize_urls(urls):
-            important = []
-            normal = []
-            for url in urls:
-                if any(pattern in url.lower() for pattern in important_patterns):
-                    important.append(url)
-                else:
-                    normal.append(url)
-            return important + normal
+                # <urlset> of <url> entries, or a <sitemapindex> of <sitemap> entries; tags are namespaced
+                for entry in tree:
+                    fields = {field.tag.rsplit('}', 1)[-1]: (field.text or '').strip() for field in entry}
+                    loc = fields.get('loc')
+                    if not loc:
+                        continue
+                    if entry.tag.endswith('sitemap'):
+                        pending.append(loc)
+                    elif (canonicalizer.is_internal(loc) and canonicalizer.canonicalize(loc).startswith(prefix)
+                          and len(urls) < max_urls):
+                        urls[loc] = parse_timestamp(fields.get('lastmod'))
+            if urls:
+                logger.info(f"Found {len(urls)} URLs in the sitemap {candidate}")
+                break
+        return urls
+
+    def _record_crawl_stats(self, base_url: str, source: str, pages_scanned: int, page_statuses: Dict[str, int],
+                            sections: List[Dict[str, Any]], duration: float, concurrency: int = 1,
+                            request_count: Optional[int] = None, fetches_avoided: int = 0, duplicates: int = 0):
+        pages_per_sec = pages_scanned / duration if duration > 0 else 0.0
+        self.crawl_stats[base_url] = {
+            "source": source,
+            "pages_scanned": pages_scanned,
+            "pages_failed": page_statuses["failed"],
+            "pages_reused": page_statuses["unchanged"] + page_statuses["not_modified"],
+            "page_statuses": page_statuses,
+            "requests": pages_scanned if request_count is None else request_count,
+            "fetches_avoided": fetches_avoided,  # Duplicate URLs not fetched thanks to canonicalization
+            "duplicates": duplicates,  # Pages fetched under a second URL and dropped
+            "sections": len(sections),
+            "duration": duration,
+            "pages_per_sec": pages_per_sec,
+            "concurrency": concurrency
+        }
+        metrics.observe("chatbot_crawl_duration_seconds", duration)
+        for status, count in page_statuses.items():
+            metrics.inc("chatbot_crawl_pages_total", count, status=status)
+        metrics.inc("chatbot_crawl_fetches_avoided_total", fetches_avoided)
+        logger.info(
+            f"Crawl ({source}) finished in {duration:.1f}s ({pages_per_sec:.1f} pages/sec, "
+            f"{page_statuses['new'] + page_statuses['changed']} parsed, "
+            f"{page_statuses['unchanged'] + page_statuses['not_modified']} unchanged, "
+            f"{page_statuses['failed']} failed, {self.crawl_stats[base_url]['requests']} requests, "
+            f"{fetches_avoided} duplicate fetches avoided, {duplicates} duplicate pages dropped)")
+
+    def scan_website_recursive(self, base_url: str, depth: int = 3, max_pages: int = 50,
+                               concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Scan website concurrently, crawling important pages first.
+        WordPress sites are read through the REST API when possible; otherwise the sitemap seeds the crawl"""
+        sitemap = {}
+        if CRAWL_DISCOVERY == "auto":
+            sections = self.ingest_wordpress(base_url, max_pages)
+            if sections:
+                logger.info(f"Scan complete: read {len(sections)} pages and posts from the WordPress REST API")
+                return self.deduplicate_sections(sections, base_url)
+            sitemap = self.read_sitemap(base_url, max_urls=max_pages * 5)
+
+        concurrency = max(1, concurrency or CRAWL_CONCURRENCY)
+        logger.info(
+            f"Starting website scan: {base_url} (depth: {depth}, max_pages: {max_pages}, concurrency: {concurrency})")
+        start_time = time.time()
+
+        # Initialize tracking. Every URL is canonicalized before it is queued, and URLs known to be
+        # aliases of another page (from earlier redirects and canonical tags) are replaced by that page
+        canonicalizer = URLCanonicalizer(base_url)
+        frontier = CrawlFrontier(IMPORTANT_PAGE_PATTERNS)  # URLs queued or processed
+        aliased = set()  # Alias URLs that were not fetched because their page is known
+
+        def queue(url: str, url_depth: int):
+            page_url = self.url_aliases.get(url, url)
+            if page_url != url:
+                aliased.add(url)
+            frontier.push(page_url, url_depth)
+
+        queue(canonicalizer.canonicalize(base_url), 1)
+        # Pages listed in the sitemap are crawled without following their links, the sitemap already lists them
+        sitemap = {canonicalizer.canonicalize(url): lastmod for url, lastmod in sitemap.items()}
+        for url in sitemap:
+            queue(url, depth)
+        sections_by_order = {}  # Collected content, keyed by dispatch order to keep output stable
+        requested = set()  # Canonical URLs fetched
+        page_urls = set()  # Canonical URLs of the pages collected, to drop redirected and canonical-tag duplicates
+        duplicates = 0
+        pages_scanned = 0
+        page_statuses = {"new": 0, "changed": 0, "unchanged": 0, "not_modified": 0, "failed": 0}
 
-        # Process each URL up to max_pages
-        while to_visit and pages_scanned < max_pages:
-            # Sort to prioritize important pages
-            to_visit = prioritize_urls(to_visit)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="crawler") as executor:
+            in_flight = {}
 
-            # Get next URL to process
-            current_url = to_visit.pop(0)
+            while frontier or in_flight:
+                # Keep the workers busy until we reach max_pages
+                while frontier and len(in_flight) < concurrency and pages_scanned < max_pages:
+                    current_url, url_depth = frontier.pop()
+                    pages_scanned += 1
+                    logger.info(f"Scanning page {pages_scanned}/{max_pages}: {current_url}")
 
-            # Skip if already visited
-            if current_url in visited:
-                continue
+                    requested.add(current_url)
+                    future = executor.submit(self._crawl_page, current_url, canonicalizer, sitemap.get(current_url))
+                    in_flight[future] = (pages_scanned, current_url, url_depth)
 
-            # Mark as visited
-            visited.add(current_url)
-            pages_scanned += 1
+                if not in_flight:
+                    break
 
-            logger.info(f"Scanning page {pages_scanned}/{max_pages}: {current_url}")
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    order, current_url, url_depth = in_flight.pop(future)
+                    try:
+                        section, links, status = future.result()
+                        page_statuses[status] += 1
+
+                        if section and section["url"] in page_urls:
+                            duplicates += 1
+                            logger.info(f"Skipping {current_url}, it is the same page as {section['url']}")
+                        elif section:
+                            sections_by_order[order] = section
+                            page_urls.add(section["url"])
+                            # A page found under another URL is not fetched again under its canonical URL
+                            frontier.push_seen(section["url"])
+                            logger.info(f"Added content from {current_url} ({status})")
+
+                            # Add unvisited links to the frontier, unless we've reached max depth
+                            if url_depth < depth and pages_scanned < max_pages:
+                                for link in links:
+                                    queue(link, url_depth + 1)
+                        else:
+                            logger.warning(f"No content extracted from {current_url}")
 
-            try:
-                # Extract content from page
-                page_text, page_soup = self.extract_text_from_url(current_url)
-
-                if page_text:
-                    # Create a section from this page
-                    section = {
-                        "title": f"Content from {current_url}",
-                        "content": self.preprocess_text(page_text),
-                        "raw_content": page_text,
-                        "url": current_url
-                    }
-
-                    # Add to sections
-                    all_sections.append(section)
-                    logger.info(f"Added content from {current_url}")
-
-                    # Don't get links if we've reached max depth
-                    if depth > 1 and pages_scanned < max_pages:
-                        # Get links from this page
-                        links = self.get_all_links(page_soup, current_url)
-
-                        # Add unvisited links to queue
-                        for link in links:
-                            if link not in visited and link not in to_visit:
-                                to_visit.append(link)
+                    except Exception as e:
+                        page_statuses["failed"] += 1
+                        logger.error(f"Error processing {current_url}: {e}")
 
-                else:
-                    logger.warning(f"No content extracted from {current_url}")
+        all_sections = [sections_by_order[order] for order in sorted(sections_by_order)]
 
-            except Exception as e:
-                logger.error(f"Error processing {current_url}: {e}")
+        fetches_avoided = canonicalizer.fetches_avoided(requested) + len(aliased)
+        self._record_crawl_stats(base_url, "sitemap" if sitemap else "links", pages_scanned, page_statuses,
+                                 all_sections, time.time() - start_time, concurrency,
+                                 fetches_avoided=fetches_avoided, duplicates=duplicates)
 
         logger.info(f"Scan complete: processed {pages_scanned} pages, found {len(all_sections)} content sections")
 
-        # Try to get content from specific important pages if we don't have enough
-        if len(all_sections) < 3 and pages_scanned < max_pages:
+        # Try to get content from specific important pages if we don't have enough (and there is no sitemap to go by)
+        if not sitemap and len(all_sections) < 3 and pages_scanned < max_pages:
             logger.warning(f"Limited content found ({len(all_sections)} sections). Trying specific URLs...")
 
             # List of important pages to try
-            extra_urls = [
-                f"{base_url}/about",
-                f"{base_url}/about-us",
-                f"{base_url}/company",
-                f"{base_url}/products"
-            ]
+            extra_urls = [canonicalizer.canonicalize(urljoin(base_url.rstrip('/') + '/', path))
+                          for path in ('about', 'about-us', 'company', 'products')]
 
             for extra_url in extra_urls:
-                if extra_url not in visited and pages_scanned < max_pages:
+                if extra_url not in frontier and pages_scanned < max_pages:
                     try:
                         logger.info(f"Trying specific URL: {extra_url}")
-                        page_text, _ = self.extract_text_from_url(extra_url)
-
-                        if page_text:
-                            section = {
-                                "title": f"Content from {extra_url}",
-                                "content": self.preprocess_text(page_text),
-                                "raw_content": page_text,
-                                "url": extra_url
-                            }
+                        section, _, _ = self._crawl_page(extra_url, canonicalizer)
+
+                        if section and section["url"] not in page_urls:
                             all_sections.append(section)
                             pages_scanned += 1
                             logger.info(f"Added content from {extra_url}")
                     except Exception as e:
                         logger.error(f"Error processing {extra_url}: {e}")
 
-        return all_sections
+        return self.deduplicate_sections(all_sections, base_url)
+
+    def _context_preamble(self, website_url: str) -> str:
+        """Opening of the context prompt: who the assistant is and how it should behave"""
+        return f"""You are a helpful AI assistant for the website: {website_url}
+
+You are the official chatbot for this website. You must respond in a human-like, conversational manner with emotional intelligence. Always try to be helpful, but recognize when a situation needs human escalation.
+
+IMPORTANT RULES:
+1. Always respond in a conversational, human-like manner
+2. Detect and adapt to user emotions in your responses
+3. If a user seems frustrated, confused, or if you cannot fully answer their question after 2-3 attempts, offer to connect them with a human team member
+4. When escalation is appropriate, ask for their email address
+5. Maintain the conversation context throughout the interaction
+6. Be proactive in offering solutions
+
+The following is information extracted from the website. Use this information to answer user questions:
+"""
+
+    def _context_instructions(self) -> str:
+        """Closing of the context prompt: how to answer and when to escalate"""
+        return """
+INSTRUCTIONS:
+1. Answer questions based ONLY on the information provided above.
+2. If the answer cannot be found in the provided information, say so clearly.
+3. Respond as if you are the official chatbot for this website.
+4. Be concise but thorough in your responses.
+5. Cite specific pages/URLs when possible in your answers.
+6. Use a conversational, friendly tone while remaining professional.
+7. Show empathy when users express confusion or frustration.
+8. Offer escalation to a human team member if:
+   - You detect user frustration
+   - The user has repeated the same question multiple times
+   - You cannot provide a satisfactory answer
+   - The request is complex or requires human judgment
+   - The user explicitly asks for human assistance
+
+ESCALATION PROCEDURE:
+If escalation is needed, say: "I'd be happy to connect you with a team member who can help further. Could you please provide your email address so they can contact you?"
+"""
+
+    def build_query_context(self, website_url: str, chunks: List[Dict[str, Any]]) -> str:
+        """Generate a context prompt for a single query from the retrieved chunks"""
+        context = self._context_preamble(website_url)
+        if not chunks:
+            context += "\n(No page on the website matched this question.)\n"
+        for chunk in chunks:
+            context += f"\n--- CONTENT FROM: {chunk['url']} ---\n\n{chunk['text']}\n\n"
+        context += self._context_instructions()
+        return context
 
     def generate_context_prompt(self, sections: List[Dict[str, Any]], website_url: str) -> str:
         """Generate a comprehensive context prompt from all website sections"""
@@ -419,71 +1377,277 @@ If the user seems frustrated, confused, or if you cannot fully answer their ques
                 sections_by_url[url] = []
             sections_by_url[url].append(section)
 
-        # Build the context prompt
-        context = f"""You are a helpful AI assistant for the website: {website_url}
+        preamble = self._context_preamble(website_url)
+        instructions = self._context_instructions()
+        remaining_tokens = CONTEXT_TOKEN_BUDGET - estimate_tokens(preamble) - estimate_tokens(instructions)
+
+        # Fill the budget with About/FAQ/Contact pages first, then the other pages in crawl order.
+        # Use the first section from each URL to avoid duplication
+        pages = sorted(sections_by_url.items(), key=lambda item: self._page_priority(item[0]))
+        about_content = ""
+        other_content = ""
+        pages_included = 0
+        pages_skipped = 0
+        for url, url_sections in pages:
+            section = url_sections[0]
+            header = "" if "about" in url.lower() else f"\n--- CONTENT FROM: {url} ---\n\n"
+            part = f"{header}{section['raw_content']}\n\n"
+
+            # The page's token count was computed when it was crawled; only the header is new
+            part_tokens = section.get("tokens") or estimate_tokens(section["raw_content"])
+            part_tokens += estimate_tokens(f"{header}\n\n")
+            if part_tokens > remaining_tokens:
+                # Doesn't fit; a smaller page further down may still fit
+                pages_skipped += 1
+                continue
 
-You are the official chatbot for this website. You must respond in a human-like, conversational manner with emotional intelligence. Always try to be helpful, but recognize when a situation needs human escalation.
+            remaining_tokens -= part_tokens
+            pages_included += 1
+            if "about" in url.lower():
+                about_content += part
+            else:
+                other_content += part
 
-IMPORTANT RULES:
-1. Always respond in a conversational, human-like manner
-2. Detect and adapt to user emotions in your responses
-3. If a user seems frustrated, confused, or if you cannot fully answer their question after 2-3 attempts, offer to connect them with a human team member
-4. When escalation is appropriate, ask for their email address
-5. Maintain the conversation context throughout the interaction
-6. Be proactive in offering solutions
+        # Build the context prompt
+        context = preamble
+        if about_content:
+            context += "\nABOUT THE COMPANY/WEBSITE:\n" + about_content
+        context += other_content
+        context += instructions
 
-The following is information extracted from the website. Use this information to answer user questions:
-"""
+        logger.info(
+            f"Context prompt: {pages_included} pages, ~{estimate_tokens(context)} tokens "
+            f"(budget {CONTEXT_TOKEN_BUDGET}), {pages_skipped} pages did not fit")
+        return context
 
-        # First include content from About pages if available
-        about_sections = []
-        for url, url_sections in sections_by_url.items():
-            if "about" in url.lower():
-                about_sections.extend(url_sections)
+    def _page_priority(self, url: str) -> int:
+        """Position of the first priority pattern in the URL, so About/FAQ/Contact pages sort first"""
+        url_lower = url.lower()
+        for priority, pattern in enumerate(PRIORITY_PAGE_PATTERNS):
+            if pattern in url_lower:
+                return priority
+        return len(PRIORITY_PAGE_PATTERNS)
+
+    def build_retrieval_index(self, website_url: str, sections: List[Dict[str, Any]]) -> Optional[RetrievalIndex]:
+        """Chunk and index the sections of a website for per-query retrieval"""
+        try:
+            start_time = time.time()
+            index = RetrievalIndex(sections)
+            self.retrieval_index[website_url] = index
+            logger.info(
+                f"Indexed {len(index.chunks)} chunks for {website_url} in {(time.time() - start_time) * 1000:.0f} ms")
+            return index
+        except Exception as e:
+            logger.error(f"Error building retrieval index for {website_url}: {e}")
+            self.retrieval_index.pop(website_url, None)
+            return None
 
-        if about_sections:
-            context += "\nABOUT THE COMPANY/WEBSITE:\n"
-            for section in about_sections[:3]:  # Limit to avoid token issues
-                context += f"{section['raw_content']}\n\n"
+    def deduplicate_sections(self, sections: List[Dict[str, Any]], website_url: str) -> List[Dict[str, Any]]:
+        """Strip site-wide boilerplate blocks and collapse near-duplicate pages.
 
-        # Add other important content
-        page_count = 0
-        for url, url_sections in sections_by_url.items():
-            # Skip About pages which we've already included
-            if "about" in url.lower():
+        A block (line) of text that appears on many pages is kept only on the first page it was
+        found on (pages are in crawl order, so important pages first). Repeated blocks within a
+        page are dropped too. Pages whose remaining text has nearly the same SimHash as a page
+        already kept are dropped. Sections that don't change are returned as-is.
+        """
+        if not sections:
+            return sections
+
+        def block_key(block):
+            return _hash64(' '.join(block.lower().split()))
+
+        def is_header(block):
+            return block.startswith(("PAGE TITLE:", "META DESCRIPTION:"))
+
+        # Count on how many pages each block appears
+        page_blocks = [section["raw_content"].split('\n') for section in sections]
+        page_frequency = {}
+        for blocks in page_blocks:
+            for key in {block_key(block) for block in blocks if block.strip() and not is_header(block)}:
+                page_frequency[key] = page_frequency.get(key, 0) + 1
+        boilerplate_threshold = max(BOILERPLATE_MIN_PAGES, int(len(sections) * BOILERPLATE_PAGE_RATIO))
+
+        kept_sections = []
+        kept_hashes = []
+        emitted = set()  # Boilerplate blocks already kept on an earlier page
+        original_chars = sum(len(section["raw_content"]) for section in sections)
+        original_bytes = sum(len(section["raw_content"].encode('utf-8')) for section in sections)
+        boilerplate_blocks = 0
+        duplicate_pages = 0
+
+        for section, blocks in zip(sections, page_blocks):
+            seen_on_page = set()
+            new_blocks = []
+            body = []
+            for block in blocks:
+                if not block.strip() or is_header(block):
+                    new_blocks.append(block)
+                    continue
+                key = block_key(block)
+                if key in seen_on_page:
+                    continue
+                seen_on_page.add(key)
+                if page_frequency[key] >= boilerplate_threshold:
+                    if key in emitted:
+                        boilerplate_blocks += 1
+                        continue
+                    emitted.add(key)
+                new_blocks.append(block)
+                body.append(block)
+
+            # Drop pages that are only boilerplate or nearly the same as a page we kept
+            body_hash = simhash(' '.join(body)) if body else None
+            if body_hash is None or any(bin(body_hash ^ kept).count('1') <= NEAR_DUPLICATE_MAX_DISTANCE
+                                        for kept in kept_hashes):
+                duplicate_pages += 1
+                logger.info(f"Dropping duplicate/boilerplate-only page {section['url']}")
                 continue
+            kept_hashes.append(body_hash)
 
-            # Limit total pages to avoid exceeding token limits
-            if page_count >= 30:
-                break
+            if len(new_blocks) == len(blocks):
+                kept_sections.append(section)
+            else:
+                raw_content = '\n'.join(new_blocks)
+                kept_sections.append({**section, "raw_content": raw_content, "tokens": estimate_tokens(raw_content)})
+
+        removed_chars = original_chars - sum(len(section["raw_content"]) for section in kept_sections)
+        removed_bytes = original_bytes - sum(len(section["raw_content"].encode('utf-8')) for section in kept_sections)
+        dedup_stats = {
+            "boilerplate_blocks_removed": boilerplate_blocks,
+            "duplicate_pages_removed": duplicate_pages,
+            "bytes_removed": removed_bytes,
+            "tokens_removed": removed_chars // 4
+        }
+        self.crawl_stats.setdefault(website_url, {})["dedup"] = dedup_stats
+        logger.info(
+            f"Deduplication removed {boilerplate_blocks} boilerplate blocks and {duplicate_pages} duplicate pages "
+            f"({removed_bytes / 1024:.0f} KB, ~{dedup_stats['tokens_removed']} tokens)")
+        return kept_sections
 
-            # Use the first section from each URL to avoid duplication
-            if url_sections:
-                context += f"\n--- CONTENT FROM: {url} ---\n\n"
-                context += f"{url_sections[0]['raw_content']}\n\n"
-                page_count += 1
+    def _sections_fingerprint(self, sections: List[Dict[str, Any]]) -> str:
+        """Hash the URLs and text of the sections, to detect whether anything changed between scans"""
+        digest = hashlib.sha1()
+        for section in sections:
+            digest.update(section["url"].encode('utf-8'))
+            digest.update(section["raw_content"].encode('utf-8'))
+        return digest.hexdigest()
 
-        context += """
-INSTRUCTIONS:
-1. Answer questions based ONLY on the information provided above.
-2. If the answer cannot be found in the provided information, say so clearly.
-3. Respond as if you are the official chatbot for this website.
-4. Be concise but thorough in your responses.
-5. Cite specific pages/URLs when possible in your answers.
-6. Use a conversational, friendly tone while remaining professional.
-7. Show empathy when users express confusion or frustration.
-8. Offer escalation to a human team member if:
-   - You detect user frustration
-   - The user has repeated the same question multiple times
-   - You cannot provide a satisfactory answer
-   - The request is complex or requires human judgment
-   - The user explicitly asks for human assistance
+    def snapshot_path(self, website_url: str) -> str:
+        """Path of the on-disk snapshot for a website"""
+        site_hash = hashlib.sha1(website_url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(SNAPSHOT_DIR, f"snapshot-{site_hash}.bin")
 
-ESCALATION PROCEDURE:
-If escalation is needed, say: "I'd be happy to connect you with a team member who can help further. Could you please provide your email address so they can contact you?"
-"""
+    def save_snapshot(self, website_url: str) -> bool:
+        """Persist the sections, per-page metadata and context prompt of a website.
 
-        return context
+        Layout: magic, version, header length, JSON header, zlib-compressed JSON payload.
+        The header can be read from a memory map without touching the payload.
+        """
+        try:
+            sections = self.website_sections.get(website_url, [])
+            pages = {url: entry for url, entry in self.page_cache.items() if url.startswith(website_url.rstrip('/'))}
+
+            # Sections that are still the cached page section are stored as a reference to avoid duplicating text
+            serialized_sections = []
+            for section in sections:
+                cached = pages.get(section["url"])
+                if cached and cached["section"] is section:
+                    serialized_sections.append({"ref": section["url"]})
+                else:
+                    serialized_sections.append(section)
+
+            payload = zlib.compress(json.dumps({
+                "context_prompt": self.context_prompt.get(website_url),
+                "sections": serialized_sections,
+                "pages": pages,
+                "aliases": {url: page_url for url, page_url in self.url_aliases.items()
+                            if url.startswith(website_url.rstrip('/'))}
+            }, separators=(',', ':')).encode('utf-8'), 6)
+            header = json.dumps({
+                "website_url": website_url,
+                "created_at": time.time(),
+                "last_scan_time": self.last_scan_time.get(website_url),
+                "sections_digest": self.sections_digest.get(website_url),
+                "sections_count": len(sections),
+                "pages_count": len(pages),
+                "payload_length": len(payload)
+            }).encode('utf-8')
+
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            path = self.snapshot_path(website_url)
+            # Write to a temporary file first so a crash never leaves a half-written snapshot
+            fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, prefix=".snapshot-")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+                f.write(header)
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+            logger.info(f"Saved snapshot for {website_url} ({len(sections)} sections, {len(payload) / 1024:.0f} KB)")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving snapshot for {website_url}: {e}")
+            return False
+
+    def read_snapshot_header(self, website_url: str) -> Optional[Dict[str, Any]]:
+        """Read only the header of a snapshot, e.g. to check whether it is stale"""
+        path = self.snapshot_path(website_url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return self._parse_snapshot_header(mm)[0]
+        except Exception as e:
+            logger.error(f"Error reading snapshot header for {website_url}: {e}")
+            return None
+
+    def _parse_snapshot_header(self, mm: mmap.mmap) -> Tuple[Optional[Dict[str, Any]], int]:
+        magic, version, header_length = SNAPSHOT_HEADER.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring snapshot with incompatible format (version {version})")
+            return None, 0
+        header_end = SNAPSHOT_HEADER.size + header_length
+        return json.loads(mm[SNAPSHOT_HEADER.size:header_end]), header_end
+
+    def load_snapshot(self, website_url: str) -> bool:
+        """Load the on-disk snapshot of a website into the caches. Returns True if a snapshot was loaded"""
+        path = self.snapshot_path(website_url)
+        if not os.path.exists(path):
+            return False
+
+        start_time = time.time()
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header, payload_start = self._parse_snapshot_header(mm)
+                if not header or header.get("website_url") != website_url:
+                    return False
+                payload = json.loads(zlib.decompress(mm[payload_start:payload_start + header["payload_length"]]))
+
+            pages = payload["pages"]
+            sections = [pages[section["ref"]]["section"] if "ref" in section else section
+                        for section in payload["sections"]]
+            for section in sections:
+                if "tokens" not in section:
+                    section["tokens"] = estimate_tokens(section["raw_content"])
+
+            self.page_cache.update(pages)
+            self.url_aliases.update(payload.get("aliases", {}))
+            self.website_sections[website_url] = sections
+            if payload.get("context_prompt"):
+                self.context_prompt[website_url] = payload["context_prompt"]
+            if header.get("last_scan_time"):
+                self.last_scan_time[website_url] = header["last_scan_time"]
+            if header.get("sections_digest"):
+                self.sections_digest[website_url] = header["sections_digest"]
+            if sections:
+                self.build_retrieval_index(website_url, sections)
+
+            logger.info(
+                f"Loaded snapshot for {website_url} ({len(sections)} sections) in {(time.time() - start_time) * 1000:.0f} ms")
+            return True
+        except Exception as e:
+            logger.error(f"Error loading snapshot for {website_url}: {e}")
+            return False
 
     def scan_website(self, website_url: str, force: bool = False) -> Dict[str, Any]:
         """Scan website and generate context prompt for the chatbot"""
@@ -523,17 +1687,29 @@ If escalation is needed, say: "I'd be happy to connect you with a team member wh
             for url in urls_crawled:
                 logger.info(f"  - {url}")
 
-            # Generate context prompt
-            context_prompt = self.generate_context_prompt(sections, website_url)
+            # Only rebuild the context prompt if some page actually changed
+            sections_digest = self._sections_fingerprint(sections)
+            if sections_digest == self.sections_digest.get(website_url) and self.context_prompt.get(website_url):
+                logger.info(f"No page changed on {website_url}, keeping the existing context prompt")
+                context_prompt = self.context_prompt[website_url]
+                if website_url not in self.retrieval_index:
+                    self.build_retrieval_index(website_url, sections)
+            else:
+                context_prompt = self.generate_context_prompt(sections, website_url)
+                self.build_retrieval_index(website_url, sections)
 
             # Update cache
             self.website_sections[website_url] = sections
             self.context_prompt[website_url] = context_prompt
+            self.sections_digest[website_url] = sections_digest
             self.last_scan_time[website_url] = current_time
+            self.save_snapshot(website_url)
 
+            crawl_stats = self.crawl_stats.get(website_url, {})
             return {
                 "context_prompt": context_prompt,
                 "sections_count": len(sections),
+                "pages_reused": crawl_stats.get("pages_reused", 0),
                 "last_scan_time": current_time,
                 "from_cache": False
             }
@@ -547,30 +1723,1128 @@ If escalation is needed, say: "I'd be happy to connect you with a team member wh
             }
 
 
+class LLMBackend(ABC):
+    """Interface of the text generation step: a system instruction, chat history and query in, reply text out.
+
+    Backends must implement `stream`; `generate` defaults to joining the streamed chunks.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def stream(self, system_instruction: str, history: List[Dict[str, Any]], query: str, sentiment: str) -> Iterator[str]:
+        """Generate a reply, yielding text chunks as they arrive"""
+
+    def generate(self, system_instruction: str, history: List[Dict[str, Any]], query: str, sentiment: str) -> str:
+        """Generate a complete reply"""
+        return ''.join(self.stream(system_instruction, history, query, sentiment))
+
+
+class GeminiClient(LLMBackend):
+    """Long-lived Gemini client: configured once, with prebuilt safety settings and per-sentiment generation configs"""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str], model_name: str = GEMINI_MODEL_NAME):
+        import google.generativeai as genai
+        from google.generativeai.types import HarmCategory, HarmBlockThreshold
+
+        # Configure the Gemini API
+        genai.configure(api_key=api_key)
+        self.genai = genai
+        self.model_name = model_name
+
+        self.safety_settings = [
+            {"category": category, "threshold": HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE}
+            for category in (
+                HarmCategory.HARM_CATEGORY_HARASSMENT,
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+            )
+        ]
+        self.generation_configs = {
+            sentiment: {
+                "temperature": temperature,
+                "top_p": 0.95,
+                "top_k": 40,
+                "max_output_tokens": 800,
+            }
+            for sentiment, temperature in SENTIMENT_TEMPERATURES.items()
+        }
+
+    def _model(self, system_instruction: str, sentiment: str):
+        # Building the model object is local and cheap; the connection lives in the configured client
+        return self.genai.GenerativeModel(
+            model_name=self.model_name,
+            generation_config=self.generation_configs.get(sentiment, self.generation_configs["neutral"]),
+            safety_settings=self.safety_settings,
+            system_instruction=system_instruction,
+        )
+
+    def generate(self, system_instruction: str, history: List[Dict[str, Any]], query: str, sentiment: str) -> str:
+        """Generate a reply with a single model call"""
+        contents = history + [{"role": "user", "parts": [query]}]
+        response = self._model(system_instruction, sentiment).generate_content(contents)
+        return response.text
+
+    def stream(self, system_instruction: str, history: List[Dict[str, Any]], query: str, sentiment: str) -> Iterator[str]:
+        """Generate a reply with a single streaming model call, yielding text chunks as they arrive"""
+        contents = history + [{"role": "user", "parts": [query]}]
+        for chunk in self._model(system_instruction, sentiment).generate_content(contents, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class MockBackendError(RuntimeError):
+    """Simulated model failure"""
+
+
+class MockBackend(LLMBackend):
+    """Offline stand-in for the model with configurable latency, throughput and error rate.
+
+    Replies are deterministic for a given query and context: an excerpt of the system
+    instruction, streamed word by word at the configured rate.
+    """
+
+    name = "mock"
+
+    def __init__(self, latency: float = MOCK_LLM_LATENCY, tokens_per_sec: float = MOCK_LLM_TOKENS_PER_SEC,
+                 error_rate: float = MOCK_LLM_ERROR_RATE, response_tokens: int = MOCK_LLM_RESPONSE_TOKENS,
+                 seed: int = MOCK_LLM_SEED):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.response_tokens = response_tokens
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def _reply(self, system_instruction: str, query: str) -> str:
+        words = system_instruction.split()
+        # Start the excerpt at a query-dependent offset, so different questions get different answers
+        start = _hash64(query) % max(1, len(words) - 1)
+        reply = [f"Thanks for asking about \"{query.strip()}\"."]
+        tokens = estimate_tokens(reply[0])
+        for word in words[start:] + words[:start]:
+            if tokens >= self.response_tokens:
+                break
+            reply.append(word)
+            tokens += estimate_tokens(word + ' ')
+        return ' '.join(reply)
+
+    def stream(self, system_instruction: str, history: List[Dict[str, Any]], query: str, sentiment: str) -> Iterator[str]:
+        with self._random_lock:
+            failed = self._random.random() < self.error_rate
+        time.sleep(self.latency)
+        if failed:
+            raise MockBackendError("Simulated model failure")
+
+        words = self._reply(system_instruction, query).split(' ')
+        for i, word in enumerate(words):
+            text = word if i == len(words) - 1 else word + ' '
+            if self.tokens_per_sec > 0:
+                time.sleep(estimate_tokens(text) / self.tokens_per_sec)
+            yield text
+
+
+def create_llm_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    """Build the configured LLM backend"""
+    if name == "mock":
+        return MockBackend()
+    if name != "gemini":
+        raise ValueError(f"Unknown LLM backend: {name}")
+    return GeminiClient(os.getenv("GEMINI_API_KEY"))
+
+
+class AnswerCache:
+    """LRU/TTL cache of AI answers for first-turn queries.
+
+    Entries belong to a context version (the fingerprint of the site's sections); a new version
+    clears the cache, so any page change invalidates every answer. Queries match exactly after
+    normalization, or as near-duplicates: TF-IDF cosine similarity over character n-grams, and
+    the same words up to typos and inflections, with identical numbers and negations.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: int = ANSWER_CACHE_TTL,
+                 similarity_threshold: float = ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.context_version = None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # Normalized query -> entry, LRU first
+        self._lock = threading.Lock()
+
+        # Near-duplicate index over the cached queries, rebuilt lazily after changes
+        self._vectorizer = None
+        self._tfidf = None
+        self._matrix = None
+        self._indexed_queries = []
+        self._index_dirty = False
+        self._index_built_at = 0.0
+        self.index_rebuild_interval = 1.0  # Seconds between rebuilds, exact matches work in between
+
+        self.hits_exact = 0
+        self.hits_similar = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Answers for these sentiments use a distinct tone; all other sentiments share answers
+    TONE_SENSITIVE_SENTIMENTS = {"frustrated", "urgent"}
+    # Words that flip the meaning of a query, near-duplicates must agree on them
+    NEGATIONS = {"no", "not", "never", "none", "nothing", "without", "cannot", "cant", "can't", "don't", "dont",
+                 "doesn't", "doesnt", "isn't", "isnt", "aren't", "won't", "wont", "didn't", "didnt"}
+    # Words that near-duplicates may add, drop or swap freely
+    FILLER_WORDS = {"a", "an", "the", "is", "are", "do", "does", "i", "you", "me", "my", "your", "can",
+                    "could", "would", "please", "there", "it", "any", "some"}
+    # Min similarity of two differing words to count as the same word (typo, plural, ...)
+    WORD_SIMILARITY = 0.8
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return ' '.join(re.sub(r"[^\w\s@.'-]", ' ', query.lower()).split())
+
+    def _tone(self, sentiment: str) -> str:
+        return sentiment if sentiment in self.TONE_SENSITIVE_SENTIMENTS else "neutral"
+
+    def _switch_version(self, context_version: str):
+        if context_version != self.context_version:
+            self._entries.clear()
+            self._indexed_queries = []
+            self._matrix = None
+            self.context_version = context_version
+
+    def _rebuild_index(self):
+        self._indexed_queries = list(self._entries)
+        self._index_dirty = False
+        self._index_built_at = time.time()
+        if not self._indexed_queries:
+            self._matrix = None
+            return
+        # Hashed n-grams have no fitted vocabulary, so n-grams that only the incoming query
+        # has still count against the similarity (with the highest IDF weight)
+        from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+        self._vectorizer = HashingVectorizer(analyzer='char_wb', ngram_range=(3, 4), alternate_sign=False, norm=None)
+        counts = self._vectorizer.transform(self._indexed_queries)
+        self._tfidf = TfidfTransformer().fit(counts)
+        self._matrix = self._tfidf.transform(counts)
+
+    @classmethod
+    def _same_words(cls, query: str, other: str) -> bool:
+        """Whether two queries use the same words, up to filler words and small spelling differences"""
+        words, other_words = set(query.split()), set(other.split())
+        # A different number or negation changes the answer however similar the rest is
+        numbers = {w for w in words if any(c.isdigit() for c in w)}
+        if numbers != {w for w in other_words if any(c.isdigit() for c in w)}:
+            return False
+        if bool(words & cls.NEGATIONS) != bool(other_words & cls.NEGATIONS):
+            return False
+
+        only_here = words - other_words - cls.FILLER_WORDS
+        only_there = other_words - words - cls.FILLER_WORDS
+        if len(only_here) != len(only_there):
+            return False
+        for word in only_here:
+            match = next((w for w in only_there
+                          if difflib.SequenceMatcher(None, word, w).ratio() >= cls.WORD_SIMILARITY), None)
+            if match is None:
+                return False
+            only_there.discard(match)
+        return True
+
+    def _find_similar(self, normalized: str, tone: str) -> Optional[Dict[str, Any]]:
+        if self._index_dirty and time.time() - self._index_built_at >= self.index_rebuild_interval:
+            self._rebuild_index()
+        if self._matrix is None:
+            return None
+
+        import numpy as np
+        from sklearn.metrics.pairwise import cosine_similarity
+        vector = self._tfidf.transform(self._vectorizer.transform([normalized]))
+        scores = cosine_similarity(vector, self._matrix).ravel()
+        for index in np.argsort(-scores)[:3]:
+            if scores[index] < self.similarity_threshold:
+                break
+            entry = self._entries.get(self._indexed_queries[index])
+            # The answer's tone depends on the sentiment, so only reuse it for the same tone
+            if entry and entry["tone"] == tone and self._same_words(normalized, entry["query"]):
+                return entry
+        return None
+
+    def get(self, query: str, context_version: str, sentiment: str) -> Optional[Dict[str, Any]]:
+        """Return a cached response for the query, or None"""
+        normalized = self.normalize(query)
+        tone = self._tone(sentiment)
+        now = time.time()
+        with self._lock:
+            self._switch_version(context_version)
+
+            entry = self._entries.get(normalized)
+            if entry and entry["tone"] == tone:
+                hit_type = "exact"
+            else:
+                entry = self._find_similar(normalized, tone)
+                hit_type = "similar"
+
+            if entry and now - entry["created_at"] > self.ttl:
+                self._entries.pop(entry["query"], None)
+                self._index_dirty = True
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                metrics.inc("chatbot_answer_cache_lookups_total", result="miss")
+                return None
+
+            self._entries.move_to_end(entry["query"])
+            if hit_type == "exact":
+                self.hits_exact += 1
+            else:
+                self.hits_similar += 1
+            metrics.inc("chatbot_answer_cache_lookups_total", result=hit_type)
+            return dict(entry["response"])
+
+    def put(self, query: str, context_version: str, sentiment: str, response: Dict[str, Any]):
+        normalized = self.normalize(query)
+        with self._lock:
+            # An answer generated before a refresh finished belongs to the old context; switching back
+            # would wipe the answers cached for the new one
+            if self.context_version is not None and context_version != self.context_version:
+                return
+            self._switch_version(context_version)
+            self._entries[normalized] = {
+                "query": normalized,
+                "tone": self._tone(sentiment),
+                "response": {"response": response["response"], "source": response["source"]},
+                "created_at": time.time()
+            }
+            self._entries.move_to_end(normalized)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._index_dirty = True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits_exact + self.hits_similar + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits_exact": self.hits_exact,
+                "hits_similar": self.hits_similar,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits_exact + self.hits_similar) / lookups if lookups else 0.0
+            }
+
+
+class MessageClassifier:
+    """Finds every sentiment and escalation signal of a message in one pass of a precompiled matcher.
+
+    All keywords are compiled into a single prefix-factored alternation inside a lookahead, so
+    finditer reports the longest keyword starting at each position of the lowercased message.
+    Each keyword maps to the signals of every keyword that is a prefix of it, which makes the
+    result identical to checking each keyword with `in`.
+    """
+
+    # Sentiments in priority order, with the keywords that indicate them
+    SENTIMENT_KEYWORDS = {
+        "urgent": ["asap", "urgent", "immediately", "emergency", "right now", "hurry", "quickly"],
+        "frustrated": ["not working", "doesn't work", "doesn't help", "unhelpful", "frustrated",
+                       "annoying", "useless", "waste", "terrible", "awful", "stupid", "!"],
+        "confused": ["don't understand", "confused", "unclear", "what do you mean", "how does", "explain", "?"],
+        "happy": ["thanks", "thank you", "great", "awesome", "excellent", "helpful", "good"],
+    }
+    # Curious messages start with one of these
+    CURIOUS_PREFIXES = ["how", "what", "where", "when", "why", "who", "can you", "is there", "tell me"]
+
+    # Keywords that might indicate frustration or a need for escalation
+    ESCALATION_KEYWORDS = [
+        "speak to a human", "talk to a human", "speak to a person", "talk to a person",
+        "speak to someone", "talk to someone", "speak to an agent", "talk to an agent",
+        "speak to a representative", "talk to a representative", "speak to a team member",
+        "talk to a team member", "speak to staff", "talk to staff", "contact me",
+        "get in touch with me", "call me", "email me", "real person", "real human",
+        "not helpful", "useless", "unhelpful", "not working", "frustrated", "annoying",
+        "doesn't work", "doesn't understand", "don't understand", "stupid", "can't help",
+        "manager", "supervisor", "human support", "live chat", "wrong", "incorrect",
+        "not what i asked", "not answering", "waste of time", "terrible", "awful",
+        "ridiculous", "joke", "terrible service", "poor service", "not satisfied",
+        "agent", "representative", "customer service", "help desk", "support team"
+    ]
+
+    # Frustration shown by typing: repeated ?/! or shouting (3+ capital letters, which covers WHY, NOT, CAN'T, HELP)
+    FRUSTRATION_PATTERN = re.compile(r"\?{2,}|!{2,}|[A-Z]{3,}")
+    EMAIL_PATTERN = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
+
+    def __init__(self):
+        signals_by_keyword: Dict[str, Set[str]] = {}
+        for sentiment, keywords in self.SENTIMENT_KEYWORDS.items():
+            for keyword in keywords:
+                signals_by_keyword.setdefault(keyword, set()).add(sentiment)
+        for keyword in self.ESCALATION_KEYWORDS:
+            signals_by_keyword.setdefault(keyword, set()).add("escalation")
+
+        # A match of the longest keyword at a position implies a match of its prefixes there
+        self._signals = {
+            keyword: frozenset().union(*(signals for other, signals in signals_by_keyword.items()
+                                         if keyword.startswith(other)))
+            for keyword in signals_by_keyword
+        }
+        self._matcher = re.compile(f"(?=({self._trie_pattern(self._signals)}))")
+        self._curious = re.compile(self._trie_pattern(self.CURIOUS_PREFIXES))
+
+    @staticmethod
+    def _trie_pattern(keywords) -> str:
+        """Alternation of keywords factored by common prefixes, so the regex branches on each character.
+        Optional suffixes are greedy, so the longest keyword wins"""
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = {}  # End of a keyword
+
+        def build(node):
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ''
+            pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            return f'(?:{pattern})?' if '' in node else pattern
+
+        return build(trie)
+
+    def _signals_in(self, text: str) -> Set[str]:
+        found = set().union(*map(self._signals.__getitem__, self._matcher.findall(text)))
+        if self._curious.match(text):
+            found.add("curious_start")
+        return found
+
+    def _result(self, message: str, found: Set[str]) -> Dict[str, Any]:
+        sentiment = next((name for name in self.SENTIMENT_KEYWORDS if name in found),
+                         "curious" if "curious_start" in found else "neutral")
+        email = None
+        if "@" in message:
+            email_match = self.EMAIL_PATTERN.search(message)
+            email = email_match.group(0) if email_match else None
+        return {
+            "sentiment": sentiment,
+            "escalation_keyword": "escalation" in found,
+            "frustration_pattern": self.FRUSTRATION_PATTERN.search(message) is not None,
+            "email": email,
+            "words": frozenset(message.lower().split())
+        }
+
+    def classify(self, message: str) -> Dict[str, Any]:
+        """Sentiment, escalation signals, email address and word set of a message"""
+        return self._result(message, self._signals_in(message.lower()))
+
+    def classify_many(self, messages: List[str]) -> List[Dict[str, Any]]:
+        """Classify a batch of messages with a single matcher run over all of them"""
+        # Keywords never contain a newline, so no match can span two messages
+        lowered = [message.lower().replace('\n', ' ') for message in messages]
+        starts = list(itertools.accumulate((len(text) + 1 for text in lowered[:-1]), initial=0))
+        found = [{"curious_start"} if self._curious.match(text) else set() for text in lowered]
+        for match in self._matcher.finditer('\n'.join(lowered)):
+            found[bisect.bisect_right(starts, match.start()) - 1] |= self._signals[match.group(1)]
+        return [self._result(message, signals) for message, signals in zip(messages, found)]
+
+
+def jaccard_similarity(words1: frozenset, words2: frozenset) -> float:
+    """Jaccard similarity of two word sets"""
+    if not words1 or not words2:
+        return 0.0
+    return len(words1 & words2) / len(words1 | words2)
+
+
+message_classifier = MessageClassifier()
+# The same message is classified several times per request (answer cache, generation, escalation)
+classify_message = functools.lru_cache(maxsize=1024)(message_classifier.classify)
+
+
+class ConversationSession:
+    """State of a single conversation"""
+    __slots__ = ("session_id", "history", "escalation_requested", "created_at", "last_seen")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.history = deque(maxlen=SESSION_HISTORY_LENGTH)
+        self.escalation_requested = False
+        self.created_at = time.time()
+        self.last_seen = self.created_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "history": [{key: value for key, value in entry.items() if key != "words"} for entry in self.history],
+            "escalation_requested": self.escalation_requested,
+            "created_at": self.created_at,
+            "last_seen": self.last_seen
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationSession":
+        session = cls(data["session_id"])
+        session.history.extend({**entry, "words": frozenset(entry["query"].lower().split())}
+                               for entry in data["history"])
+        session.escalation_requested = data["escalation_requested"]
+        session.created_at = data["created_at"]
+        session.last_seen = data["last_seen"]
+        return session
+
+    def add_exchange(self, query: str, response: str):
+        self.history.append({
+            "query": query[:SESSION_MAX_MESSAGE_CHARS],
+            "words": frozenset(query[:SESSION_MAX_MESSAGE_CHARS].lower().split()),  # For repetition checks
+            "response": response[:SESSION_MAX_MESSAGE_CHARS],
+            "timestamp": time.time(),
+            "escalation_requested": self.escalation_requested
+        })
+
+
+class SessionStore:
+    """Bounded in-memory store of conversation sessions with idle TTL and LRU eviction.
+
+    Memory is capped at max_sessions x SESSION_HISTORY_LENGTH x SESSION_MAX_MESSAGE_CHARS.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX_COUNT, idle_ttl: int = SESSION_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+
+    def _evict_expired(self, now: float):
+        # Sessions are ordered by last use, so expired ones are always at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_seen <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted_ttl += 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict_expired(time.time())
+            return len(self._sessions)
+
+    def get(self, session_id: Optional[str] = None) -> ConversationSession:
+        """Return the session for an id, creating it if needed. A new id is generated when none is given"""
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = ConversationSession(session_id or str(uuid.uuid4()))
+                self._sessions[session.session_id] = session
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted_lru += 1
+            else:
+                self._sessions.move_to_end(session.session_id)
+
+            session.last_seen = now
+            return session
+
+    def save(self, session: ConversationSession):
+        """Sessions are updated in place, nothing to write back"""
+
+    def export(self) -> List[ConversationSession]:
+        """The live sessions, least recently used first"""
+        with self._lock:
+            self._evict_expired(time.time())
+            return list(self._sessions.values())
+
+    def restore(self, sessions: List[ConversationSession]):
+        """Add sessions kept elsewhere meanwhile (e.g. while the site was unloaded); newer copies win"""
+        with self._lock:
+            merged = {session.session_id: session for session in sessions}
+            merged.update(self._sessions)
+            self._sessions = OrderedDict(
+                (session.session_id, session) for session in sorted(merged.values(), key=lambda s: s.last_seen))
+            self._evict_expired(time.time())
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted_lru += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._evict_expired(time.time())
+            return {
+                "live_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "created": self.created,
+                "evicted_idle": self.evicted_ttl,
+                "evicted_lru": self.evicted_lru
+            }
+
+
+class SqliteSessionStore:
+    """Conversation sessions in a SQLite database shared by every worker on the machine,
+    so a conversation continues whichever worker handles the next message.
+
+    Same interface as SessionStore; callers save() a session after changing it.
+    """
+
+    CLEANUP_INTERVAL = 60  # Seconds between idle TTL and size limit sweeps
+
+    def __init__(self, path: str = SHARED_STATE_DB, site_id: str = DEFAULT_SITE_ID,
+                 max_sessions: int = SESSION_MAX_COUNT, idle_ttl: int = SESSION_IDLE_TTL):
+        self.path = path
+        self.site_id = site_id  # Sites share the database, each only sees its own conversations
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()  # One connection per thread
+        self._last_cleanup = 0.0
+        self.created = 0
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS conversations (site_id TEXT NOT NULL, session_id TEXT NOT NULL, "
+            "data TEXT NOT NULL, last_seen REAL NOT NULL, PRIMARY KEY (site_id, session_id))")
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS conversations_last_seen ON conversations (site_id, last_seen)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL lets readers in other workers proceed while one worker writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _cleanup(self, now: float):
+        if now - self._last_cleanup < self.CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        connection = self._connection()
+        self.evicted_ttl += connection.execute(
+            "DELETE FROM conversations WHERE site_id = ? AND last_seen < ?", (self.site_id, now - self.idle_ttl)).rowcount
+        self.evicted_lru += connection.execute(
+            "DELETE FROM conversations WHERE site_id = ? AND session_id IN (SELECT session_id FROM conversations "
+            "WHERE site_id = ? ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (self.site_id, self.site_id, self.max_sessions)).rowcount
+
+    def __len__(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM conversations WHERE site_id = ?", (self.site_id,)).fetchone()[0]
+
+    def get(self, session_id: Optional[str] = None) -> ConversationSession:
+        """Return the session for an id, creating it if needed. A new id is generated when none is given"""
+        now = time.time()
+        self._cleanup(now)
+
+        session = None
+        if session_id:
+            row = self._connection().execute(
+                "SELECT data FROM conversations WHERE site_id = ? AND session_id = ?", (self.site_id, session_id)).fetchone()
+            if row:
+                session = ConversationSession.from_dict(json.loads(row[0]))
+                if now - session.last_seen > self.idle_ttl:
+                    session = None
+                    self.evicted_ttl += 1
+
+        if session is None:
+            session = ConversationSession(session_id or str(uuid.uuid4()))
+            self.created += 1
+
+        # Written back by save() once the exchange is added
+        session.last_seen = now
+        return session
+
+    def save(self, session: ConversationSession):
+        """Write a session back after it changed"""
+        self.save_all([session])
+
+    def save_all(self, sessions: List[ConversationSession]):
+        connection = self._connection()
+        with connection:  # One transaction (commit on success, rollback on error)
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO conversations (site_id, session_id, data, last_seen) VALUES (?, ?, ?, ?)",
+                [(self.site_id, session.session_id, json.dumps(session.to_dict()), session.last_seen)
+                 for session in sessions])
+
+    def take_all(self) -> List[ConversationSession]:
+        """Remove the site's sessions from the database and return the ones that haven't expired"""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            rows = connection.execute("SELECT data FROM conversations WHERE site_id = ? AND last_seen >= ?",
+                                      (self.site_id, time.time() - self.idle_ttl)).fetchall()
+            connection.execute("DELETE FROM conversations WHERE site_id = ?", (self.site_id,))
+        return [ConversationSession.from_dict(json.loads(row[0])) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "live_sessions": len(self),
+            "max_sessions": self.max_sessions,
+            "created": self.created,  # By this worker
+            "evicted_idle": self.evicted_ttl,
+            "evicted_lru": self.evicted_lru
+        }
+
+
+class CrawlerLock:
+    """Inter-process lock electing the worker that crawls.
+
+    The lock is held for the life of the process. If the crawling worker dies the OS releases it,
+    and the next worker to try takes over.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """Try to become the crawler without blocking. Returns True if this process holds the lock"""
+        if self._file is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:
+            return True  # No flock on this platform, only single-worker deployments are supported
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        logger.info(f"Worker {os.getpid()} is the crawler")
+        return True
+
+
+class EmailDeliveryError(Exception):
+    """An EmailJS request failed; `retryable` tells whether trying again may succeed"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class EscalationEmailQueue:
+    """Durable queue of escalation emails, delivered to EmailJS by background workers.
+
+    Pending jobs and dead letters are written to disk after every change, so a restart resumes
+    delivery where it stopped. Failed sends are retried with exponential backoff; jobs that fail
+    permanently or run out of attempts are moved to the dead-letter list.
+    """
+
+    # Set headers to mimic a browser request, EmailJS rejects requests that don't look like one
+    HEADERS = {
+        "Content-Type": "application/json",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "Origin": "https://www.emailjs.com",
+        "Referer": "https://www.emailjs.com/",
+        "Accept": "application/json, text/plain, */*",
+        "Accept-Language": "en-US,en;q=0.9",
+        "X-Requested-With": "XMLHttpRequest",
+        "sec-ch-ua": '"Google Chrome";v="91", "Chromium";v="91", ";Not A Brand";v="99"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-fetch-dest": "empty",
+        "sec-fetch-mode": "cors",
+        "sec-fetch-site": "same-origin"
+    }
+    MAX_FINISHED_JOBS = 1000  # Sent jobs and dead letters kept for status lookups, each
+
+    def __init__(self, path: str = EMAIL_QUEUE_FILE, workers: int = EMAIL_QUEUE_WORKERS,
+                 max_attempts: int = EMAIL_MAX_ATTEMPTS, base_delay: float = EMAIL_RETRY_BASE_DELAY,
+                 max_delay: float = EMAIL_RETRY_MAX_DELAY, per_process: bool = False):
+        # With several workers each one keeps its own file, and adopts the files of workers that are gone
+        self.per_process = per_process
+        self.base_path = path
+        self.path = self._process_path(os.getpid()) if per_process else path
+        self.worker_count = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._pending: Dict[str, Dict[str, Any]] = {}  # Queued, retrying or sending jobs by id
+        self._sent: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._dead_letters: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._due = []  # Heap of (next attempt time, job id)
+        self._condition = threading.Condition()
+        self._workers = []
+        self._started = False
+
+        self.sent = 0
+        self.failed_attempts = 0
+        self.dead_lettered = 0
+
+        # Pooled connection to EmailJS, shared by the workers
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.worker_count)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.HEADERS)
+
+    def start(self):
+        """Load the persisted jobs and resume delivering them, once. Called when the server starts (and on
+        first use), not on import, so processes that only import this module never send or adopt emails"""
+        with self._condition:
+            if not self._started:
+                self._started = True
+                self._load()
+
+    def _process_path(self, pid: int) -> str:
+        root, ext = os.path.splitext(self.base_path)
+        return f"{root}-{pid}{ext}"
+
+    @staticmethod
+    def _process_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _read_state(self, path: str) -> Dict[str, Any]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read email queue {path}: {e}")
+            return {}
+
+    def _orphaned_states(self) -> List[Dict[str, Any]]:
+        """Claim the queue files of workers that are no longer running"""
+        root, ext = os.path.splitext(self.base_path)
+        states = []
+        for path in glob.glob(f"{glob.escape(root)}-*{ext}"):
+            pid = path[len(root) + 1:len(path) - len(ext)]
+            if not pid.isdigit() or int(pid) == os.getpid() or self._process_alive(int(pid)):
+                continue
+            # Renaming is atomic, so only one worker claims each file
+            claimed_path = f"{path}.{os.getpid()}.claimed"
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                continue
+            states.append(self._read_state(claimed_path))
+            os.remove(claimed_path)
+            logger.info(f"Adopted the email queue of stopped worker {pid}")
+        return states
+
+    def _load(self):
+        """Resume the jobs that were pending when the process stopped"""
+        states = [self._read_state(self.path)]
+        if self.per_process:
+            states += self._orphaned_states()
+
+        now = time.time()
+        state = {
+            "pending": [job for state in states for job in state.get("pending", [])],
+            "dead_letters": [job for state in states for job in state.get("dead_letters", [])]
+        }
+        for job in state.get("pending", []):
+            # A job that was being sent may or may not have been delivered; send it again
+            job["status"] = "queued" if job["status"] == "sending" else job["status"]
+            self._pending[job["id"]] = job
+            heapq.heappush(self._due, (max(now, job["next_attempt_at"]), job["id"]))
+        for job in state.get("dead_letters", []):
+            self._dead_letters[job["id"]] = job
+
+        if len(states) > 1:
+            self._save()
+        if self._pending:
+            logger.info(f"Resuming delivery of {len(self._pending)} queued escalation emails")
+            self._start_workers()
+
+    def _save(self):
+        """Write pending jobs and dead letters atomically (called with the lock held)"""
+        state = {"pending": list(self._pending.values()), "dead_letters": list(self._dead_letters.values())}
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Could not write email queue {self.path}: {e}")
+
+    def _start_workers(self):
+        if self._workers:
+            return
+        for i in range(self.worker_count):
+            worker = threading.Thread(target=self._work, name=f"email-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, template_params: Dict[str, Any]) -> str:
+        """Queue an escalation email and return its job id; delivery happens in the background"""
+        self.start()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "template_params": template_params,
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now,
+            "last_error": None
+        }
+        with self._condition:
+            self._pending[job_id] = job
+            heapq.heappush(self._due, (now, job_id))
+            self._save()
+            self._start_workers()
+            self._condition.notify()
+        logger.info(f"ESCALATION: Queued email {job_id}")
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Delivery status of a job, without its content"""
+        self.start()
+        with self._condition:
+            job = self._pending.get(job_id) or self._sent.get(job_id) or self._dead_letters.get(job_id)
+            if not job:
+                return None
+            return {key: value for key, value in job.items() if key != "template_params"}
+
+    def _next_job(self) -> Dict[str, Any]:
+        """Block until a job is due, and mark it as being sent"""
+        with self._condition:
+            while True:
+                now = time.time()
+                if self._due and self._due[0][0] <= now:
+                    _, job_id = heapq.heappop(self._due)
+                    job = self._pending.get(job_id)
+                    if job is None:
+                        continue
+                    job["status"] = "sending"
+                    job["attempts"] += 1
+                    self._save()
+                    return job
+                self._condition.wait(timeout=self._due[0][0] - now if self._due else None)
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                self._deliver(job)
+            except EmailDeliveryError as e:
+                self._failed(job, e)
+            except Exception as e:
+                self._failed(job, EmailDeliveryError(str(e)))
+            else:
+                self._delivered(job)
+
+    def _deliver(self, job: Dict[str, Any]):
+        data = {
+            "service_id": EMAILJS_SERVICE_ID,
+            "template_id": EMAILJS_TEMPLATE_ID,
+            "user_id": EMAILJS_PUBLIC_KEY,
+            "template_params": job["template_params"]
+        }
+        try:
+            with metrics.time("chatbot_email_send_seconds"):
+                response = self.session.post(EMAILJS_URL, json=data, timeout=EMAIL_REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            metrics.inc("chatbot_email_failures_total", reason="request")
+            raise EmailDeliveryError(f"Request failed: {e}")
+
+        if response.status_code != 200:
+            metrics.inc("chatbot_email_failures_total", reason="status")
+            # Rate limiting and server errors are temporary, other client errors won't go away
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise EmailDeliveryError(f"Status code {response.status_code}: {response.text[:200]}", retryable)
+
+    def _delivered(self, job: Dict[str, Any]):
+        with self._condition:
+            self._pending.pop(job["id"], None)
+            job.update({"status": "sent", "sent_at": time.time(), "last_error": None})
+            job.pop("template_params", None)
+            self._sent[job["id"]] = job
+            while len(self._sent) > self.MAX_FINISHED_JOBS:
+                self._sent.popitem(last=False)
+            self.sent += 1
+            self._save()
+        logger.info(f"ESCALATION: Sent email {job['id']} (attempt {job['attempts']})")
+
+    def _failed(self, job: Dict[str, Any], error: EmailDeliveryError):
+        with self._condition:
+            self.failed_attempts += 1
+            job["last_error"] = str(error)
+            if not error.retryable or job["attempts"] >= self.max_attempts:
+                self._pending.pop(job["id"], None)
+                job["status"] = "dead"
+                self._dead_letters[job["id"]] = job
+                while len(self._dead_letters) > self.MAX_FINISHED_JOBS:
+                    self._dead_letters.popitem(last=False)
+                self.dead_lettered += 1
+                metrics.inc("chatbot_email_dead_letters_total")
+                logger.error(f"ESCALATION: Giving up on email {job['id']} after {job['attempts']} attempts: {error}")
+            else:
+                # Exponential backoff with jitter, so retries of a failed burst don't arrive together
+                delay = min(self.max_delay, self.base_delay * 2 ** (job["attempts"] - 1)) * random.uniform(0.5, 1.0)
+                job["status"] = "retrying"
+                job["next_attempt_at"] = time.time() + delay
+                heapq.heappush(self._due, (job["next_attempt_at"], job["id"]))
+                self._condition.notify()
+                logger.warning(
+                    f"ESCALATION: Email {job['id']} attempt {job['attempts']} failed ({error}), retrying in {delay:.1f}s")
+            self._save()
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return {
+                "pending": len(self._pending),
+                "sent": self.sent,
+                "failed_attempts": self.failed_attempts,
+                "dead_letters": len(self._dead_letters)
+            }
+
+
+email_queue = EscalationEmailQueue(per_process=SHARED_STATE)
+metrics.callback("chatbot_email_queue_pending", "gauge", "Escalation emails waiting to be delivered",
+                 lambda: email_queue.stats()["pending"])
+
+
+# Limits how many sites crawl at once, so scheduled crawls can't take over the machine
+crawl_slots = threading.BoundedSemaphore(max(1, CRAWL_MAX_CONCURRENT_SITES))
+
+
 class ChatbotManager:
-    def __init__(self, website_url):
+    def __init__(self, website_url, site_id: str = DEFAULT_SITE_ID):
         self.scanner = WebsiteScanner()
         self.website_url = website_url
-        self.context_prompt = None
+        self.site_id = site_id
+        # Start with a default context; the website is scanned in the background
+        self.context_prompt = f"You are a helpful AI assistant for the website: {self.website_url}. Answer user questions about this website and its content in a friendly, professional manner. If you don't know the answer, simply say so politely."
         self.last_scan_time = None
-        self.history = []
-        self.escalation_requested = False
-        self.init_context()
+        self.retrieval_index = None
+        self.last_refresh_attempt = None
+        self.context_retry_interval = 15 * 60  # Retry a failed scan after 15 minutes
+        self.sessions = SqliteSessionStore(site_id=site_id) if SHARED_STATE else SessionStore()
+        self._restore_parked_sessions()
+        self.answer_cache = AnswerCache()
+        # In shared-state mode only the worker holding the lock crawls; the others follow its snapshots
+        site_hash = hashlib.sha1(website_url.encode('utf-8')).hexdigest()[:16]
+        self.crawler_lock = CrawlerLock(os.path.join(SNAPSHOT_DIR, f"crawler-{site_hash}.lock")) if SHARED_STATE else None
+        self.snapshot_mtime = None
+        self.last_snapshot_check = 0.0
+        self.context_version = None
+        self._llm_backend = None
+        self._llm_lock = threading.Lock()
+        self._context_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        self.load_snapshot()
+
+    def load_snapshot(self) -> bool:
+        """Use the last-known context from the on-disk snapshot, if there is one"""
+        self.snapshot_mtime = self._snapshot_mtime()
+        if not self.scanner.load_snapshot(self.website_url):
+            logger.info(f"No snapshot found for {self.website_url}, a full scan is needed")
+            return False
+
+        context_prompt = self.scanner.context_prompt.get(self.website_url)
+        last_scan_time = self.scanner.last_scan_time.get(self.website_url)
+        if not context_prompt or not last_scan_time:
+            return False
+
+        self._set_context(context_prompt, last_scan_time, self.scanner.retrieval_index.get(self.website_url))
+        return True
+
+    def _snapshot_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.scanner.snapshot_path(self.website_url))
+        except OSError:
+            return None
+
+    @property
+    def is_crawler(self) -> bool:
+        """Whether this process scans the website (always, unless in shared-state mode)"""
+        if not CRAWLER_ENABLED:
+            return False
+        return self.crawler_lock is None or self.crawler_lock.acquire()
+
+    @property
+    def is_refreshing(self) -> bool:
+        return self._refresh_thread is not None and self._refresh_thread.is_alive()
+
+    def park_sessions(self) -> int:
+        """Write the conversations held only in memory to SHARED_STATE_DB before the site is unloaded,
+        so they continue when it is loaded again. Returns the number of conversations written"""
+        if SHARED_STATE:
+            return 0  # Already in the database
+        sessions = self.sessions.export()
+        if sessions:
+            SqliteSessionStore(site_id=self.site_id).save_all(sessions)
+        return len(sessions)
+
+    def _restore_parked_sessions(self):
+        if SHARED_STATE or not os.path.exists(SHARED_STATE_DB):
+            return
+        try:
+            sessions = SqliteSessionStore(site_id=self.site_id).take_all()
+        except sqlite3.Error as e:
+            logger.error(f"Error restoring the conversations of site {self.site_id}: {e}")
+            return
+        if sessions:
+            self.sessions.restore(sessions)
+            logger.info(f"Restored {len(sessions)} conversations of site {self.site_id}")
+
+    def _set_context(self, context_prompt: str, last_scan_time: float, retrieval_index: Optional[RetrievalIndex] = None):
+        """Swap in a new context prompt and index, so requests see either the old or the new context"""
+        with self._context_lock:
+            self.context_prompt = context_prompt
+            self.last_scan_time = last_scan_time
+            self.retrieval_index = retrieval_index
+            # Answers come from the retrieved sections, not just the prompt, so key them on every section
+            fingerprint = (self.scanner.sections_digest.get(self.website_url)
+                           or hashlib.sha1(context_prompt.encode('utf-8')).hexdigest())
+            self.context_version = fingerprint[:16]
+
+    def _get_context(self) -> Tuple[str, Optional[RetrievalIndex]]:
+        with self._context_lock:
+            return self.context_prompt, self.retrieval_index
+
+    def _build_query_context(self, query: str) -> str:
+        """Context for a single query: only the relevant chunks if the website is indexed, the full prompt otherwise"""
+        context_prompt, retrieval_index = self._get_context()
+        if retrieval_index is None:
+            return context_prompt
+
+        chunks = retrieval_index.search(query)
+        logger.info(f"Retrieved {len(chunks)} chunks for query")
+        return self.scanner.build_query_context(self.website_url, chunks)
 
     def init_context(self):
-        """Initialize context by scanning the website"""
+        """Initialize context by scanning the website. The current context keeps being served until the scan is done"""
+        # Wait for a crawl slot; the site keeps serving its current context meanwhile
+        with crawl_slots:
+            self._scan_context()
+
+    def _scan_context(self):
         logger.info(f"Initializing context for {self.website_url}")
+        self.last_refresh_attempt = time.time()
         try:
-            # Set a default context in case of failure
-            self.context_prompt = f"You are a helpful AI assistant for the website: {self.website_url}. Answer user questions about this website and its content in a friendly, professional manner. If you don't know the answer, simply say so politely."
-            self.last_scan_time = time.time()
-
             # Try to scan the website completely
             scan_result = self.scanner.scan_website(self.website_url, force=True)
 
             if scan_result["sections_count"] > 0:
-                self.context_prompt = scan_result["context_prompt"]
-                self.last_scan_time = scan_result["last_scan_time"]
+                context_prompt = scan_result["context_prompt"]
+                last_scan_time = scan_result["last_scan_time"]
+                retrieval_index = self.scanner.retrieval_index.get(self.website_url)
                 logger.info(f"Context initialized with {scan_result['sections_count']} sections")
 
                 # If we didn't get many sections, retry with a deeper scan
@@ -582,184 +2856,311 @@ class ChatbotManager:
 
                     if len(sections) > scan_result["sections_count"]:
                         # Generate a new context prompt with the additional sections
-                        new_context = self.scanner.generate_context_prompt(sections, self.website_url)
-                        self.context_prompt = new_context
-                        self.last_scan_time = time.time()
+                        context_prompt = self.scanner.generate_context_prompt(sections, self.website_url)
+                        retrieval_index = self.scanner.build_retrieval_index(self.website_url, sections)
+                        last_scan_time = time.time()
                         logger.info(f"Deep scan successful, expanded to {len(sections)} sections")
+
+                        # Persist the expanded context, other workers and restarts load it from the snapshot
+                        self.scanner.website_sections[self.website_url] = sections
+                        self.scanner.context_prompt[self.website_url] = context_prompt
+                        self.scanner.sections_digest[self.website_url] = self.scanner._sections_fingerprint(sections)
+                        self.scanner.last_scan_time[self.website_url] = last_scan_time
+                        self.scanner.save_snapshot(self.website_url)
                     else:
                         logger.warning(f"Deep scan did not find additional content")
+
+                self._set_context(context_prompt, last_scan_time, retrieval_index)
+                # This process wrote the snapshot, so following it would only rebuild the same index again
+                self.snapshot_mtime = self._snapshot_mtime()
             else:
-                logger.warning(f"No sections found for {self.website_url}, using default context")
+                logger.warning(f"No sections found for {self.website_url}, keeping the current context")
         except Exception as e:
             logger.error(f"Error initializing context: {e}")
-            # We already set a default context above, so no need to set it again
+            # The current (default or stale) context is kept
+
+    def _run_refresh(self, target):
+        try:
+            target()
+        finally:
+            with self._refresh_lock:
+                self._refresh_thread = None
+
+    def start_background_refresh(self, target=None) -> bool:
+        """Scan the website (or run another context update) on a background thread.
+        Returns False if a refresh is already running"""
+        with self._refresh_lock:
+            if self.is_refreshing:
+                return False
+            self._refresh_thread = threading.Thread(target=self._run_refresh, args=(target or self.init_context,),
+                                                    name="context-refresh", daemon=True)
+            self._refresh_thread.start()
+        logger.info(f"Started background context refresh for {self.website_url}")
+        return True
+
+    def _follow_snapshot(self):
+        """Load the snapshot in the background when another process wrote a new one"""
+        current_time = time.time()
+        if current_time - self.last_snapshot_check < SHARED_STATE_POLL_INTERVAL or self.is_refreshing:
+            return
+        self.last_snapshot_check = current_time
+        snapshot_mtime = self._snapshot_mtime()
+        if snapshot_mtime is not None and snapshot_mtime != self.snapshot_mtime:
+            logger.info(f"Snapshot for {self.website_url} changed, reloading the context")
+            self.start_background_refresh(self.load_snapshot)
 
     def refresh_context_if_needed(self):
-        """Check if context needs refreshing (after 72 hours)"""
+        """Check if context needs refreshing (after 72 hours) and refresh it in the background"""
+        if SHARED_STATE:
+            self._follow_snapshot()
+
         current_time = time.time()
-        if self.last_scan_time is None or (current_time - self.last_scan_time > self.scanner.context_expiry_time):
-            logger.info(f"Context expired. Refreshing...")
-            self.init_context()
+        expired = self.last_scan_time is None or (current_time - self.last_scan_time > self.scanner.context_expiry_time)
+        if not expired or self.is_refreshing:
+            return
 
-    def get_response(self, query: str) -> Dict[str, Any]:
-        """Generate a response based on the website content using AI"""
-        # Check if context needs refreshing
-        self.refresh_context_if_needed()
+        # Another worker or a separate crawl job owns scanning
+        if not self.is_crawler:
+            return
 
-        # Generate response using AI
-        response_data = self._generate_ai_response(query)
+        # Don't hammer the website if the last scan failed
+        if self.last_refresh_attempt and current_time - self.last_refresh_attempt < self.context_retry_interval:
+            return
 
-        # Add escalation check
-        response_data = self._check_for_escalation_request(query, response_data)
+        logger.info("Context expired. Refreshing in the background...")
+        self.start_background_refresh()
 
-        # Update history
-        self.history.append({
-            "query": query,
-            "response": response_data["response"],
-            "timestamp": time.time(),
-            "escalation_requested": self.escalation_requested
-        })
+    def get_response(self, query: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Generate a response based on the website content using AI, within the given conversation"""
+        start_time = time.time()
 
-        return response_data
+        # Check if context needs refreshing
+        self.refresh_context_if_needed()
 
-    def _similarity(self, text1: str, text2: str) -> float:
-        """Calculate similarity between two texts (simple method)"""
-        # This is a basic implementation - could be improved with better NLP techniques
-        words1 = set(text1.lower().split())
-        words2 = set(text2.lower().split())
+        session = self.sessions.get(session_id)
 
-        if not words1 or not words2:
-            return 0.0
+        # Generate response using AI, or reuse the answer to the same first question
+        response_data = self._cached_ai_response(query, session)
 
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
+        # Add escalation check
+        response_data = self._check_for_escalation_request(query, response_data, session)
 
-        return len(intersection) / len(union)
+        # Update history
+        session.add_exchange(query, response_data["response"])
+        self.sessions.save(session)
 
-    def _send_escalation_email(self, user_email: str, last_query: str) -> bool:
-        """Send an escalation email with the conversation history using EmailJS but with browser-like headers"""
-        try:
-            logger.info(f"ESCALATION: Starting email escalation process for {user_email}")
-
-            # Prepare the conversation history
-            conversation = "\n\n".join([
-                f"User: {entry['query']}\nChatbot: {entry['response']}"
-                for entry in self.history
-            ])
-
-            # Prepare template parameters for EmailJS
-            template_params = {
-                "website_url": self.website_url,
-                "user_email": user_email,
-                "user_query": last_query,
-                "conversation": conversation,
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            }
+        response_data["conversation_id"] = session.session_id
+        metrics.observe("chatbot_response_seconds", time.time() - start_time, mode="complete")
+        return response_data
 
-            # Create the request payload
-            data = {
-                "service_id": EMAILJS_SERVICE_ID,
-                "template_id": EMAILJS_TEMPLATE_ID,
-                "user_id": EMAILJS_PUBLIC_KEY,
-                "template_params": template_params
-            }
+    def _is_cacheable(self, session: ConversationSession) -> bool:
+        """Only first turns are cached: later answers depend on the conversation history"""
+        return not session.history and not session.escalation_requested
+
+    def _cached_ai_response(self, query: str, session: ConversationSession) -> Dict[str, Any]:
+        """Generate a response using AI, going through the answer cache when the turn doesn't depend on history"""
+        if not self._is_cacheable(session):
+            return self._generate_ai_response(query, session)
+
+        context_version = self.context_version
+        sentiment = self._analyze_user_sentiment(query)
+        cached = self.answer_cache.get(query, context_version, sentiment)
+        if cached:
+            logger.info("Answered from the answer cache")
+            cached["cached"] = True
+            cached["prompt_tokens"] = 0  # Nothing was sent to the model
+            return cached
+
+        response_data = self._generate_ai_response(query, session)
+        if "error" not in response_data:
+            self.answer_cache.put(query, context_version, sentiment, response_data)
+        return response_data
 
-            # Set headers to mimic a browser request with enhanced headers
-            headers = {
-                "Content-Type": "application/json",
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Origin": "https://www.emailjs.com",  # Changed to emailjs.com
-                "Referer": "https://www.emailjs.com/",  # Changed to emailjs.com
-                "Accept": "application/json, text/plain, */*",
-                "Accept-Language": "en-US,en;q=0.9",
-                "X-Requested-With": "XMLHttpRequest",
-                "sec-ch-ua": '"Google Chrome";v="91", "Chromium";v="91", ";Not A Brand";v="99"',
-                "sec-ch-ua-mobile": "?0",
-                "sec-fetch-dest": "empty",
-                "sec-fetch-mode": "cors",
-                "sec-fetch-site": "same-origin"
-            }
+    def stream_response(self, query: str, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Generate a response as a stream of frames:
+        "chunk" frames with incremental text, an optional "escalation" frame with text to append
+        (or "replace" frame when the whole response changed), and a final "done" frame.
+        The "done" frame has an "error" field when the model failed; an answer cut off midway
+        is not saved to the conversation history
+        """
+        start_time = time.time()
+        first_token_time = None
 
-            # Log the full request details
-            logger.info(f"ESCALATION: EmailJS request URL: {EMAILJS_URL}")
-            logger.info(f"ESCALATION: EmailJS request headers: {json.dumps(headers)}")
-            logger.info(f"ESCALATION: EmailJS request payload: {json.dumps(data)}")
+        # Check if context needs refreshing
+        self.refresh_context_if_needed()
 
-            try:
-                # Send the request to EmailJS API
-                logger.info(f"ESCALATION: Sending request to EmailJS...")
-                response = requests.post(
-                    EMAILJS_URL,
-                    headers=headers,
-                    json=data,
-                    timeout=20
-                )
-
-                # Log the full response
-                logger.info(f"ESCALATION: EmailJS response status code: {response.status_code}")
-                logger.info(f"ESCALATION: EmailJS response headers: {dict(response.headers)}")
-                logger.info(f"ESCALATION: EmailJS response body: {response.text}")
-
-                # Check response
-                if response.status_code == 200:
-                    logger.info(f"ESCALATION: Successfully sent email to {user_email}")
-                    return True
-                else:
-                    logger.error(
-                        f"ESCALATION: Failed to send email: Status code {response.status_code}, Response: {response.text}")
-                    return False
+        session = self.sessions.get(session_id)
+        source = f"Information from {self.website_url}"
+        chunks = []
+        error = None
+        truncated = False
+        prompt_tokens = 0
 
-            except Exception as request_error:
-                logger.error(f"ESCALATION: Error in email request: {request_error}")
-                import traceback
-                logger.error(f"ESCALATION: Traceback: {traceback.format_exc()}")
-                return False
+        # Analyze user sentiment to adjust response tone
+        sentiment = self._analyze_user_sentiment(query)
+        context_version = self.context_version
+        cacheable = self._is_cacheable(session)
+        cached = self.answer_cache.get(query, context_version, sentiment) if cacheable else None
 
+        try:
+            if cached:
+                logger.info("Answered from the answer cache")
+                source = cached["source"]
+                first_token_time = time.time()
+                chunks.append(cached["response"])
+                yield {"type": "chunk", "text": cached["response"]}
+            else:
+                client = self._get_llm_backend()
+                system_instruction = self._build_system_instruction(query, sentiment)
+                chat_history = self._build_chat_history(session)
+                prompt_tokens = self._count_prompt_tokens(system_instruction, chat_history, query)
+                llm_start = time.time()
+                for text in client.stream(system_instruction, chat_history, query, sentiment):
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                        metrics.observe("chatbot_llm_first_token_seconds", first_token_time - llm_start,
+                                        backend=client.name)
+                    chunks.append(text)
+                    yield {"type": "chunk", "text": text}
+                metrics.observe("chatbot_llm_request_seconds", time.time() - llm_start, backend=client.name)
         except Exception as e:
-            logger.error(f"ESCALATION: Error preparing email: {e}")
-            import traceback
-            logger.error(f"ESCALATION: Traceback: {traceback.format_exc()}")
-            return False
+            fallback = self._ai_error_response(e)
+            error = fallback["error"]
+            source = fallback["source"]
+            # Don't mix a fallback message into a partially streamed answer
+            truncated = bool(chunks)
+            if not truncated:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                chunks.append(fallback["response"])
+                yield {"type": "chunk", "text": fallback["response"]}
+
+        streamed_text = ''.join(chunks)
+        if cacheable and not cached and error is None:
+            self.answer_cache.put(query, context_version, sentiment, {"response": streamed_text, "source": source})
 
+        # Add escalation check
+        response_data = self._check_for_escalation_request(query, {"response": streamed_text, "source": source}, session)
+        response_text = response_data["response"]
+        if response_text.startswith(streamed_text):
+            if len(response_text) > len(streamed_text):
+                yield {"type": "escalation", "text": response_text[len(streamed_text):]}
+        else:
+            yield {"type": "replace", "text": response_text}
+
+        # Update history, unless the answer was cut off: the next turns shouldn't build on half an answer
+        if truncated:
+            logger.warning("Model failed mid-stream, the partial answer is not saved to the conversation")
+        else:
+            session.add_exchange(query, response_text)
+            self.sessions.save(session)
+
+        total_time = time.time() - start_time
+        metrics.observe("chatbot_response_seconds", total_time, mode="stream")
+        time_to_first_token = (first_token_time or time.time()) - start_time
+        logger.info(f"Streamed response: first token after {time_to_first_token:.2f}s, total {total_time:.2f}s")
+
+        done = {
+            "type": "done",
+            "response": response_text,
+            "source": source,
+            "conversation_id": session.session_id,
+            "cached": bool(cached),
+            "prompt_tokens": prompt_tokens,
+            "timing": {
+                "time_to_first_token": time_to_first_token,
+                "total": total_time
+            }
+        }
+        if error:
+            done["error"] = error
+            done["truncated"] = truncated
+        if "escalation_id" in response_data:
+            done["escalation_id"] = response_data["escalation_id"]
+        yield done
+
+    def _queue_escalation_email(self, user_email: str, last_query: str, session: ConversationSession) -> str:
+        """Queue an escalation email with the conversation history; returns the delivery job id"""
+        # Prepare the conversation history
+        conversation = "\n\n".join([
+            f"User: {entry['query']}\nChatbot: {entry['response']}"
+            for entry in session.history
+        ])
+
+        # Prepare template parameters for EmailJS
+        template_params = {
+            "website_url": self.website_url,
+            "user_email": user_email,
+            "user_query": last_query,
+            "conversation": conversation,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        }
+        return email_queue.submit(template_params)
 
     def _analyze_user_sentiment(self, query: str) -> str:
         """
         Analyze the user's message to detect sentiment and adapt response style.
         Returns one of: "neutral", "frustrated", "curious", "happy", "confused", "urgent"
         """
-        query_lower = query.lower()
+        return classify_message(query)["sentiment"]
+
+    def _get_llm_backend(self) -> LLMBackend:
+        """Create the LLM backend on first use and reuse it for every request"""
+        if self._llm_backend is None:
+            with self._llm_lock:
+                if self._llm_backend is None:
+                    self._llm_backend = create_llm_backend()
+        return self._llm_backend
+
+    def _build_system_instruction(self, query: str, sentiment: str) -> str:
+        """Context prompt for this query, enhanced for robust, human-like responses"""
+        enhanced_context = self._build_query_context(query) + "\n\n"
+        enhanced_context += "Additional instructions:\n"
+        enhanced_context += "1. Be conversational and helpful like a human customer service agent.\n"
+        enhanced_context += "2. Show empathy when users express frustration or confusion.\n"
+        enhanced_context += "3. Use natural language that's professional but not overly formal.\n"
+        enhanced_context += "4. If you can't help with a specific request, suggest what the user might do next.\n"
+        enhanced_context += "5. Avoid saying 'As an AI' or referring to yourself as a bot or AI.\n"
+        enhanced_context += f"6. The user's sentiment appears to be: {sentiment}. Adjust your tone accordingly.\n"
+        return enhanced_context
+
+    def _build_chat_history(self, session: ConversationSession) -> List[Dict[str, Any]]:
+        """Recent conversation history, so the AI maintains context across messages"""
+        chat_history = []
+        for entry in list(session.history)[-5:]:  # Include up to 5 previous exchanges
+            chat_history.append({"role": "user", "parts": [entry["query"]]})
+            chat_history.append({"role": "model", "parts": [entry["response"]]})
+        return chat_history
+
+    def _count_prompt_tokens(self, system_instruction: str, chat_history: List[Dict[str, Any]], query: str) -> int:
+        """Estimated size of the prompt sent to the model"""
+        prompt_tokens = estimate_tokens(system_instruction) + estimate_tokens(query)
+        prompt_tokens += sum(estimate_tokens(part) for message in chat_history for part in message["parts"])
+        metrics.observe("chatbot_prompt_tokens", prompt_tokens)
+        logger.info(f"Prompt size: ~{prompt_tokens} tokens")
+        return prompt_tokens
+
+    def _ai_error_response(self, error: Exception) -> Dict[str, Any]:
+        """Fallback response for when Gemini can't be used"""
+        metrics.inc("chatbot_llm_errors_total", backend=LLM_BACKEND,
+                    kind="unavailable" if isinstance(error, ImportError) else "error")
+        if isinstance(error, ImportError):
+            logger.error("Google Generative AI package not installed. Run: pip install google-generativeai")
+            return {
+                "response": "I'm having trouble connecting to my knowledge base. The Google Generative AI package is not installed.",
+                "source": f"Error from {self.website_url}",
+                "error": "ai_unavailable"
+            }
 
-        # Check for urgent language
-        urgent_indicators = ["asap", "urgent", "immediately", "emergency", "right now", "hurry", "quickly"]
-        if any(indicator in query_lower for indicator in urgent_indicators):
-            return "urgent"
-
-        # Check for frustrated language
-        frustrated_indicators = ["not working", "doesn't work", "doesn't help", "unhelpful", "frustrated",
-                                 "annoying", "useless", "waste", "terrible", "awful", "stupid"]
-        if any(indicator in query_lower for indicator in frustrated_indicators) or "!" in query:
-            return "frustrated"
-
-        # Check for confused language
-        confused_indicators = ["don't understand", "confused", "unclear", "what do you mean", "how does",
-                               "explain"]
-        if any(indicator in query_lower for indicator in confused_indicators) or "?" in query:
-            return "confused"
-
-        # Check for happy/satisfied language
-        happy_indicators = ["thanks", "thank you", "great", "awesome", "excellent", "helpful", "good"]
-        if any(indicator in query_lower for indicator in happy_indicators):
-            return "happy"
-
-        # Check for curious language (questions, asking for more information)
-        curious_indicators = ["how", "what", "where", "when", "why", "who", "can you", "is there", "tell me"]
-        if any(query_lower.startswith(indicator) for indicator in curious_indicators):
-            return "curious"
-
-        # Default sentiment
-        return "neutral"
-
-    def _generate_ai_response(self, query: str) -> Dict[str, Any]:
+        logger.error(f"LLM backend error: {error}")
+        # Fallback response that doesn't rely on Gemini
+        return {
+            "response": "I'm having trouble accessing my knowledge base right now. For specific questions, please try again in a moment or ask to speak with a team member for immediate assistance.",
+            "source": f"Limited information from {self.website_url}",
+            "error": "ai_error"
+        }
+
+    def _generate_ai_response(self, query: str, session: ConversationSession) -> Dict[str, Any]:
         """Generate a response using Google Gemini based on the context prompt with enhanced human-like qualities"""
         try:
             # Basic error checking
@@ -769,120 +3170,28 @@ class ChatbotManager:
                     "source": self.website_url
                 }
 
-            # Call Gemini API with error handling
+            # Call the LLM backend with error handling
             try:
-                import google.generativeai as genai
-                from google.generativeai.types import HarmCategory, HarmBlockThreshold
-
-                # Configure the Gemini API
-                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                client = self._get_llm_backend()
 
                 # Analyze user sentiment to adjust response tone
                 sentiment = self._analyze_user_sentiment(query)
 
-                # Adjust response parameters based on sentiment
-                temperature = 0.7  # Default temperature for natural responses
-
-                if sentiment == "frustrated":
-                    # More careful and empathetic for frustrated users
-                    temperature = 0.4  # Lower temperature for more controlled responses
-                elif sentiment == "curious":
-                    # More detailed and thorough for curious users
-                    temperature = 0.5
-                elif sentiment == "urgent":
-                    # More direct and concise for urgent queries
-                    temperature = 0.3  # Lower temperature for more focused responses
-
-                # Set up the model
-                generation_config = {
-                    "temperature": temperature,
-                    "top_p": 0.95,
-                    "top_k": 40,
-                    "max_output_tokens": 800,
-                }
-
-                # Set up safety settings
-                safety_settings = [
-                    {
-                        "category": HarmCategory.HARM_CATEGORY_HARASSMENT,
-                        "threshold": HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
-                    },
-                    {
-                        "category": HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                        "threshold": HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
-                    },
-                    {
-                        "category": HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                        "threshold": HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
-                    },
-                    {
-                        "category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                        "threshold": HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
-                    },
-                ]
-
-                # Get the generative model
-                model = genai.GenerativeModel(
-                    model_name="gemini-2.0-flash",
-                    generation_config=generation_config,
-                    safety_settings=safety_settings,
-                )
-
-                # Build conversation history for context
-                chat_history = []
-
-                # Include recent conversation history for continuity
-                # This helps the AI maintain context across multiple messages
-                history_to_include = min(5, len(self.history))  # Include up to 5 previous exchanges
-
-                for i in range(max(0, len(self.history) - history_to_include), len(self.history)):
-                    chat_history.append({"role": "user", "parts": [self.history[i]["query"]]})
-                    chat_history.append({"role": "model", "parts": [self.history[i]["response"]]})
-
-                # Enhance the context prompt for robust, human-like responses
-                enhanced_context = self.context_prompt + "\n\n"
-                enhanced_context += "Additional instructions:\n"
-                enhanced_context += "1. Be conversational and helpful like a human customer service agent.\n"
-                enhanced_context += "2. Show empathy when users express frustration or confusion.\n"
-                enhanced_context += "3. Use natural language that's professional but not overly formal.\n"
-                enhanced_context += "4. If you can't help with a specific request, suggest what the user might do next.\n"
-                enhanced_context += "5. Avoid saying 'As an AI' or referring to yourself as a bot or AI.\n"
-                enhanced_context += f"6. The user's sentiment appears to be: {sentiment}. Adjust your tone accordingly.\n"
-
-                # Start a chat session with history if available
-                if chat_history:
-                    chat = model.start_chat(history=chat_history)
-                else:
-                    chat = model.start_chat(history=[])
-
-                # Send the system prompt first
-                system_message = f"System: {enhanced_context}"
-                chat.send_message(system_message)
-
-                # Send the user's query
-                response = chat.send_message(query)
-
-                # Get the response text
-                response_text = response.text
+                # A single model call: the context goes in the system instruction, followed by history and query
+                system_instruction = self._build_system_instruction(query, sentiment)
+                chat_history = self._build_chat_history(session)
+                prompt_tokens = self._count_prompt_tokens(system_instruction, chat_history, query)
+                with metrics.time("chatbot_llm_request_seconds", backend=client.name):
+                    response_text = client.generate(system_instruction, chat_history, query, sentiment)
 
                 return {
                     "response": response_text,
-                    "source": f"Information from {self.website_url}"
+                    "source": f"Information from {self.website_url}",
+                    "prompt_tokens": prompt_tokens
                 }
 
-            except ImportError:
-                logger.error("Google Generative AI package not installed. Run: pip install google-generativeai")
-                return {
-                    "response": "I'm having trouble connecting to my knowledge base. The Google Generative AI package is not installed.",
-                    "source": f"Error from {self.website_url}"
-                }
             except Exception as api_error:
-                logger.error(f"Gemini API error: {api_error}")
-                # Fallback response that doesn't rely on Gemini
-                return {
-                    "response": "I'm having trouble accessing my knowledge base right now. For specific questions, please try again in a moment or ask to speak with a team member for immediate assistance.",
-                    "source": f"Limited information from {self.website_url}"
-                }
+                return self._ai_error_response(api_error)
 
         except Exception as e:
             logger.error(f"Error generating response: {e}")
@@ -891,109 +3200,70 @@ class ChatbotManager:
                 "source": self.website_url
             }
 
-    def _check_for_escalation_request(self, query: str, response_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _check_for_escalation_request(self, query: str, response_data: Dict[str, Any],
+                                      session: ConversationSession) -> Dict[str, Any]:
         """Check if the user is requesting to speak with a human agent or if the situation requires escalation"""
-        # Keywords that might indicate frustration or a need for escalation
-        escalation_keywords = [
-            "speak to a human", "talk to a human", "speak to a person", "talk to a person",
-            "speak to someone", "talk to someone", "speak to an agent", "talk to an agent",
-            "speak to a representative", "talk to a representative", "speak to a team member",
-            "talk to a team member", "speak to staff", "talk to staff", "contact me",
-            "get in touch with me", "call me", "email me", "real person", "real human",
-            "not helpful", "useless", "unhelpful", "not working", "frustrated", "annoying",
-            "doesn't work", "doesn't understand", "don't understand", "stupid", "can't help",
-            "manager", "supervisor", "human support", "live chat", "wrong", "incorrect",
-            "not what i asked", "not answering", "waste of time", "terrible", "awful",
-            "ridiculous", "joke", "terrible service", "poor service", "not satisfied",
-            "agent", "representative", "customer service", "help desk", "support team"
-        ]
-
-        # Frustration indicators (punctuation, capitalization, etc.)
-        frustration_patterns = [
-            r'\?{2,}',  # Multiple question marks
-            r'\!{2,}',  # Multiple exclamation marks
-            r'[A-Z]{3,}',  # ALL CAPS (3+ letters)
-            r'\bWHY\b',  # "WHY" in all caps
-            r'\bNOT\b',  # "NOT" in all caps
-            r'\bCAN\'T\b',  # "CAN'T" in all caps
-            r'\bHELP\b'  # "HELP" in all caps
-        ]
+        signals = classify_message(query)
+        query_lower = query.lower()
 
-        # Simple check for email in the query - this runs for ALL queries
-        import re
-        has_email = False
-        email = None
-        if "@" in query and "." in query.split("@")[1]:
-            email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-            email_matches = re.findall(email_pattern, query)
-            if email_matches:
-                has_email = True
-                email = email_matches[0]
-                logger.info(f"ESCALATION: Detected email address in query: {email}")
+        # Check for an email address in the query - this runs for ALL queries
+        email = signals["email"]
+        has_email = email is not None
+        if has_email:
+            logger.info(f"ESCALATION: Detected email address in query: {email}")
 
         # Check conversation length - proactively offer help for long conversations
-        conversation_too_long = len(self.history) >= 5  # Offer escalation after 5 exchanges
+        conversation_too_long = len(session.history) >= 5  # Offer escalation after 5 exchanges
 
         # Repetition detection (if user repeats the same question)
-        query_lower = query.lower()
-        recent_queries = [entry["query"].lower() for entry in self.history[-3:]] if len(self.history) >= 3 else []
-        repeated_question = any(self._similarity(query_lower, prev_query) > 0.7 for prev_query in recent_queries)
-
-        # Check for explicit escalation keywords
-        explicit_escalation = any(keyword in query_lower for keyword in escalation_keywords)
+        recent_queries = list(session.history)[-3:] if len(session.history) >= 3 else []
+        repeated_question = any(jaccard_similarity(signals["words"], entry["words"]) > 0.7 for entry in recent_queries)
 
-        # Check for frustration patterns
-        frustration_detected = any(re.search(pattern, query) for pattern in frustration_patterns)
+        # Check for explicit escalation keywords and frustration patterns
+        explicit_escalation = signals["escalation_keyword"]
+        frustration_detected = signals["frustration_pattern"]
 
         # Determine if escalation is needed
         escalation_needed = explicit_escalation or frustration_detected or repeated_question or conversation_too_long
 
         # If we detect an email AND escalation was previously requested, send the email
-        if has_email and self.escalation_requested:
+        if has_email and session.escalation_requested:
             logger.info(f"ESCALATION FLOW: Detected email after escalation was requested. Email: {email}")
+            metrics.inc("chatbot_escalations_total", trigger="email_after_offer")
 
-            # Attempt to send the email
+            # Queue the email, it is delivered in the background
             try:
-                email_sent = self._send_escalation_email(email, query)
-                logger.info(f"ESCALATION FLOW: Email sending result: {email_sent}")
-
-                if email_sent:
-                    response_data[
-                        "response"] = f"Thank you! A team member will contact you at {email} shortly. Your conversation has been forwarded to our support team."
-                else:
-                    response_data[
-                        "response"] = f"Thank you for providing your email address ({email}). However, there was an issue sending the notification. A team member will review this conversation and contact you as soon as possible."
+                response_data["escalation_id"] = self._queue_escalation_email(email, query, session)
+                response_data[
+                    "response"] = f"Thank you! A team member will contact you at {email} shortly. Your conversation has been forwarded to our support team."
 
                 # Reset escalation flag
-                self.escalation_requested = False
+                session.escalation_requested = False
 
             except Exception as e:
-                logger.error(f"ESCALATION FLOW: Error sending email: {e}")
+                logger.error(f"ESCALATION FLOW: Error queueing email: {e}")
                 import traceback
                 logger.error(f"ESCALATION FLOW: Traceback: {traceback.format_exc()}")
                 response_data[
                     "response"] = f"Thank you for providing your email address. However, there was an error sending the notification. A team member will review this conversation and contact you as soon as possible."
-                self.escalation_requested = False
+                session.escalation_requested = False
 
         # If we see an email but escalation wasn't requested (special handling)
-        elif has_email and not self.escalation_requested:
+        elif has_email and not session.escalation_requested:
             logger.info(
                 f"ESCALATION FLOW: Email detected without prior escalation request. Treating as implicit escalation.")
+            metrics.inc("chatbot_escalations_total", trigger="implicit_email")
             try:
-                email_sent = self._send_escalation_email(email, query)
-                if email_sent:
-                    response_data[
-                        "response"] = f"Thank you for providing your email address. I've forwarded your information to our team, and someone will contact you at {email} shortly."
-                else:
-                    # Continue with normal response - don't override it
-                    pass
+                response_data["escalation_id"] = self._queue_escalation_email(email, query, session)
+                response_data[
+                    "response"] = f"Thank you for providing your email address. I've forwarded your information to our team, and someone will contact you at {email} shortly."
             except Exception as e:
                 logger.error(f"ESCALATION FLOW: Error with implicit email escalation: {e}")
                 # Continue with normal response - don't override it
                 pass
 
         # If escalation was requested but no email provided yet
-        elif self.escalation_requested and not has_email:
+        elif session.escalation_requested and not has_email:
             logger.info(f"ESCALATION FLOW: Escalation requested but no email provided in this message.")
             # If the message doesn't contain an email but looks like it might be attempting to provide one
             if len(query) < 50 and ("@" in query or "mail" in query_lower or "contact" in query_lower):
@@ -1001,56 +3271,319 @@ class ChatbotManager:
                     "response"] = "I couldn't detect a valid email address. Could you please provide your complete email address so our team can contact you? For example: yourname@example.com"
 
         # If escalation is needed but not yet requested, add escalation message
-        elif escalation_needed and not self.escalation_requested:
+        elif escalation_needed and not session.escalation_requested:
             # Different escalation messages based on the trigger
             if conversation_too_long:
                 escalation_message = "\n\nI notice we've been talking for a while. Would you like me to connect you with a team member who might be able to help further? If so, please provide your email address, and someone will reach out to you directly."
                 logger.info("ESCALATION FLOW: Triggering escalation due to long conversation")
+                trigger = "long_conversation"
             elif repeated_question:
                 escalation_message = "\n\nI notice I may not be addressing your question adequately. Would you like to speak with a team member who can help you more directly? If so, please share your email address, and someone will contact you soon."
                 logger.info("ESCALATION FLOW: Triggering escalation due to repeated questions")
+                trigger = "repeated_question"
             elif explicit_escalation:
                 escalation_message = "\n\nI'd be happy to connect you with a team member. Please provide your email address, and someone will contact you shortly."
                 logger.info("ESCALATION FLOW: Triggering escalation due to explicit request")
+                trigger = "explicit_request"
             else:  # frustration detected
                 escalation_message = "\n\nI understand this might be frustrating. Would you like to speak with a team member directly? If so, please provide your email address, and someone will contact you soon."
                 logger.info("ESCALATION FLOW: Triggering escalation due to detected frustration")
+                trigger = "frustration"
 
             # Enhance the response with the appropriate escalation offer
             response_data["response"] += escalation_message
-            self.escalation_requested = True
+            session.escalation_requested = True
+            metrics.inc("chatbot_escalations_total", trigger=trigger)
             logger.info("ESCALATION FLOW: Escalation has been requested")
 
         return response_data
 
 
-# Initialize chatbot manager with the hard-coded website URL
-chatbot_manager = ChatbotManager(WEBSITE_URL)
+class UnknownSiteError(Exception):
+    """Raised when a request doesn't identify a configured site"""
+
+
+def load_sites() -> Dict[str, Dict[str, Any]]:
+    """Sites served by this process: the entries of SITES_FILE, or just WEBSITE_URL"""
+    if not SITES_FILE:
+        return {DEFAULT_SITE_ID: {"site_id": DEFAULT_SITE_ID, "url": WEBSITE_URL, "api_key": None}}
+
+    with open(SITES_FILE, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    sites = {}
+    for entry in entries:
+        sites[entry["site_id"]] = {"site_id": entry["site_id"], "url": entry["url"], "api_key": entry.get("api_key")}
+    logger.info(f"Loaded {len(sites)} sites from {SITES_FILE}")
+    return sites
+
+
+class SiteRegistry:
+    """The sites served by this process, each with its own ChatbotManager (context, index, caches, sessions).
+
+    Managers are created on a site's first request, loading its snapshot, and the least recently
+    used ones are evicted beyond max_loaded, so memory grows with the active sites, not all sites.
+    Evicted sites' conversations are parked in SHARED_STATE_DB until the site is loaded again. Sites
+    with a scan running are not evicted (the scan would otherwise run twice), so the limit may be
+    exceeded while scans run.
+    """
+
+    def __init__(self, sites: Dict[str, Dict[str, Any]], max_loaded: int = MAX_LOADED_SITES):
+        self.sites = sites
+        self.max_loaded = max(1, max_loaded)
+        self._by_api_key = {site["api_key"]: site_id for site_id, site in sites.items() if site.get("api_key")}
+        self._managers: "OrderedDict[str, ChatbotManager]" = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}  # One site loading doesn't block the others
+        self.loads = 0
+        self.evictions = 0
+
+    def resolve(self, site_id: Optional[str] = None, api_key: Optional[str] = None) -> str:
+        """The site a request is for, by API key, then site id, then the only or default site"""
+        if api_key:
+            if api_key not in self._by_api_key:
+                raise UnknownSiteError("Unknown API key")
+            return self._by_api_key[api_key]
+        if site_id:
+            if site_id not in self.sites:
+                raise UnknownSiteError(f"Unknown site: {site_id}")
+            return site_id
+        if len(self.sites) == 1:
+            return next(iter(self.sites))
+        if DEFAULT_SITE_ID in self.sites:
+            return DEFAULT_SITE_ID
+        raise UnknownSiteError("No site given")
+
+    def get(self, site_id: str) -> ChatbotManager:
+        """The manager of a site, loading it on first use"""
+        with self._lock:
+            manager = self._managers.get(site_id)
+            if manager is not None:
+                self._managers.move_to_end(site_id)
+                return manager
+            load_lock = self._load_locks.setdefault(site_id, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                manager = self._managers.get(site_id)
+            if manager is None:
+                site = self.sites[site_id]
+                manager = ChatbotManager(site["url"], site_id)
+                with self._lock:
+                    self._managers[site_id] = manager
+                    self.loads += 1
+                    while len(self._managers) > self.max_loaded:
+                        evicted_id = next((loaded_id for loaded_id, loaded in self._managers.items()
+                                           if loaded_id != site_id and not loaded.is_refreshing), None)
+                        if evicted_id is None:
+                            logger.warning(f"{len(self._managers)} sites loaded, over the limit of {self.max_loaded}: "
+                                           f"the others are scanning")
+                            break
+                        self._evict(evicted_id)
+            return manager
+
+    def _evict(self, site_id: str):
+        """Unload a site (with the registry lock held, so it can't be reloaded before its conversations are parked)"""
+        manager = self._managers.pop(site_id)
+        self.evictions += 1
+        try:
+            parked = manager.park_sessions()
+        except sqlite3.Error as e:
+            logger.error(f"Error saving the conversations of site {site_id}, they are dropped: {e}")
+            parked = 0
+        logger.info(f"Evicted site {site_id} from memory ({parked} conversations parked)")
+
+    def loaded(self) -> List[ChatbotManager]:
+        with self._lock:
+            return list(self._managers.values())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "configured": len(self.sites),
+                "loaded": len(self._managers),
+                "max_loaded": self.max_loaded,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
+
+
+sites = SiteRegistry(load_sites())
+
+
+def site_response(site_id: str, query: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """Answer a query for a site (runs on the query pipeline, which also absorbs loading the site)"""
+    return sites.get(site_id).get_response(query, session_id)
+
+
+def site_stream(site_id: str, query: str, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    yield from sites.get(site_id).stream_response(query, session_id)
+
+
+def load_site_at_startup(site_id: str):
+    """Load a site's snapshot and start a scan if it is stale or missing"""
+    try:
+        with startup.phase("site_load"):
+            site_manager = sites.get(site_id)
+        site_manager.refresh_context_if_needed()
+    except Exception as e:
+        logger.error(f"Error loading site {site_id} at startup: {e}")
+
+
+@app.on_event("startup")
+async def start_context_refresh():
+    """Load the site in the background so the server can accept traffic (and answer /health) immediately;
+    queries arriving meanwhile wait for the load. With several sites, each one is loaded on its first request instead"""
+    startup.record("app_startup", STARTUP_BEGAN)
+    if len(sites.sites) == 1:
+        asyncio.get_running_loop().run_in_executor(None, load_site_at_startup, next(iter(sites.sites)))
+
+
+@app.on_event("startup")
+async def start_email_queue():
+    """Resume delivering the escalation emails that were queued before the last shutdown"""
+    email_queue.start()
+
+
+@app.on_event("startup")
+async def mark_startup_ready():
+    """Registered last: once the other startup handlers ran, the server accepts requests"""
+    startup.mark_ready()
+
+
+@app.on_event("shutdown")
+async def stop_parse_pool():
+    parse_pool.shutdown()
 
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        # Keyed by socket, not client id: two tabs of the same client are two connections
+        self.active_connections: Dict[WebSocket, str] = {}  # Open socket -> client id
 
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
-        self.active_connections[client_id] = websocket
+        self.active_connections[websocket] = client_id
 
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
+    def disconnect(self, websocket: WebSocket):
+        self.active_connections.pop(websocket, None)
 
-    async def send_message(self, message: str, client_id: str):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_text(message)
+    async def send_message(self, message: str, websocket: WebSocket):
+        if websocket in self.active_connections:
+            await websocket.send_text(message)
 
 
 manager = ConnectionManager()
+metrics.callback("chatbot_websocket_connections", "gauge", "Open WebSocket connections",
+                 lambda: len(manager.active_connections))
+
+
+class QueryOverloadedError(Exception):
+    """Raised when too many queries are already running or waiting"""
+
+
+class QueryPipeline:
+    """Runs the blocking chatbot pipeline (Gemini, EmailJS, ...) on a bounded thread pool.
+
+    At most `concurrency` queries run at once and at most `queue_limit` more may wait;
+    beyond that new queries are rejected so a slow backend can't pile up unbounded work.
+    Admission counters are only touched from the event loop, so they need no lock.
+    """
+
+    def __init__(self, concurrency: int = QUERY_CONCURRENCY, queue_limit: int = QUERY_QUEUE_LIMIT):
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = max(0, queue_limit)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="query")
+        self.in_flight = 0  # Running plus waiting queries
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def is_overloaded(self) -> bool:
+        return self.in_flight >= self.concurrency + self.queue_limit
+
+    def _admit(self):
+        if self.is_overloaded:
+            self.rejected += 1
+            raise QueryOverloadedError(f"{self.in_flight} queries already in flight")
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self.completed += 1
+
+    async def run(self, func, *args):
+        """Run a blocking function on the pool and await its result"""
+        self._admit()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+        finally:
+            self._release()
+
+    async def stream(self, frames: Iterator[Any]):
+        """Advance a blocking generator on the pool, yielding its items as they are produced"""
+        self._admit()
+        done = object()
+        pending = None
+        try:
+            while True:
+                pending = self.executor.submit(next, frames, done)
+                frame = await asyncio.wrap_future(pending)
+                if frame is done:
+                    break
+                yield frame
+        finally:
+            try:
+                self._close_when_idle(frames, pending)
+            finally:
+                self._release()
+
+    @staticmethod
+    def _close_when_idle(frames: Iterator[Any], pending: Optional[Future]):
+        """Close a generator once it is no longer executing.
+
+        A cancelled stream (e.g. the client disconnected) can leave next() running on the pool;
+        closing the generator then would raise, so it is closed when that call returns instead.
+        """
+        if pending is None or pending.done():
+            frames.close()
+        else:
+            pending.add_done_callback(lambda _: frames.close())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.in_flight,
+            "waiting": max(0, self.in_flight - self.concurrency),
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+
+query_pipeline = QueryPipeline()
+metrics.callback("chatbot_sessions", "gauge", "Live conversation sessions of the loaded sites",
+                 lambda: sum(len(m.sessions) for m in sites.loaded()))
+metrics.callback("chatbot_sites_loaded", "gauge", "Sites with their context loaded in memory",
+                 lambda: sites.stats()["loaded"])
+metrics.callback("chatbot_queries_in_flight", "gauge", "Queries running or waiting in the query pipeline",
+                 lambda: query_pipeline.in_flight)
+metrics.callback("chatbot_queries_rejected_total", "counter", "Queries rejected because the pipeline was full",
+                 lambda: query_pipeline.rejected)
+
+# Returned when the query pipeline is full
+OVERLOADED_RESPONSE = {
+    "response": "I'm getting a lot of questions right now. Please try again in a few seconds.",
+    "source": "Error handler",
+    "error": "overloaded"
+}
 
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await manager.connect(websocket, client_id)
+    connection_site_id = websocket.query_params.get("site_id")
+    api_key = websocket.query_params.get("api_key") or websocket.headers.get("x-api-key")
     try:
         while True:
             data = await websocket.receive_text()
@@ -1058,29 +3591,60 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
 
             if message.get("type") == "query":
                 query = message.get("query")
-                result = chatbot_manager.get_response(query)
-                await manager.send_message(json.dumps(result), client_id)
+                # Each WebSocket client is its own conversation unless the widget sends its conversation id
+                session_id = message.get("conversation_id") or client_id
+
+                try:
+                    site_id = sites.resolve(message.get("site_id") or connection_site_id, api_key)
+                    if message.get("stream"):
+                        # Send each frame as soon as it is generated
+                        frames = site_stream(site_id, query, session_id)
+                        async for frame in query_pipeline.stream(frames):
+                            await manager.send_message(json.dumps(frame), websocket)
+                    else:
+                        result = await query_pipeline.run(site_response, site_id, query, session_id)
+                        await manager.send_message(json.dumps(result), websocket)
+                except UnknownSiteError as e:
+                    await manager.send_message(json.dumps({"type": "error", "error": "unknown_site", "detail": str(e)}), websocket)
+                except QueryOverloadedError:
+                    logger.warning(f"Query pipeline overloaded, rejecting WebSocket query from {client_id}")
+                    await manager.send_message(json.dumps({**OVERLOADED_RESPONSE, "type": "error"}), websocket)
 
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        pass
+    finally:
+        # Also on errors (e.g. a message that isn't JSON), so the connection gauge can't leak
+        manager.disconnect(websocket)
 
 
 # REST API endpoints
+def unknown_site_response(error: UnknownSiteError) -> JSONResponse:
+    return JSONResponse(status_code=404, content={"error": "unknown_site", "detail": str(error)})
+
+
 @app.post("/api/query")
-async def api_query(query: Query):
+async def api_query(query: Query, x_api_key: Optional[str] = Header(None)):
     """Process a query from the user and get a response from the chatbot"""
+    try:
+        site_id = sites.resolve(query.site_id, x_api_key)
+    except UnknownSiteError as e:
+        return unknown_site_response(e)
+
     try:
         # Log the incoming query
-        logger.info(f"Received query: {query.query}")
+        logger.info(f"Received query for {site_id}: {query.query}")
 
-        # Get response from chatbot
-        result = chatbot_manager.get_response(query.query)
+        # Get response from chatbot, without blocking the event loop
+        result = await query_pipeline.run(site_response, site_id, query.query, query.conversation_id)
 
         # Log response summary
         logger.info(
             f"Response length: {len(result.get('response', ''))} chars, source: {result.get('source', 'unknown')}")
 
         return result
+    except QueryOverloadedError:
+        logger.warning("Query pipeline overloaded, rejecting query")
+        return JSONResponse(status_code=503, content=OVERLOADED_RESPONSE, headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Error processing query: {e}")
         return {
@@ -1089,6 +3653,32 @@ async def api_query(query: Query):
         }
 
 
+@app.post("/api/query/stream")
+async def api_query_stream(query: Query, x_api_key: Optional[str] = Header(None)):
+    """Process a query and stream the response as Server-Sent Events"""
+    try:
+        site_id = sites.resolve(query.site_id, x_api_key)
+    except UnknownSiteError as e:
+        return unknown_site_response(e)
+    logger.info(f"Received streaming query for {site_id}: {query.query}")
+
+    if query_pipeline.is_overloaded:
+        logger.warning("Query pipeline overloaded, rejecting streaming query")
+        query_pipeline.rejected += 1
+        return JSONResponse(status_code=503, content=OVERLOADED_RESPONSE, headers={"Retry-After": "5"})
+
+    async def event_stream():
+        try:
+            frames = site_stream(site_id, query.query, query.conversation_id)
+            async for frame in query_pipeline.stream(frames):
+                yield f"event: {frame['type']}\ndata: {json.dumps(frame)}\n\n"
+        except QueryOverloadedError:
+            yield f"event: error\ndata: {json.dumps({**OVERLOADED_RESPONSE, 'type': 'error'})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # EmailJS endpoint for frontend use
 @app.post("/api/send-email")
 async def send_email(request: Request):
@@ -1110,9 +3700,14 @@ async def send_email(request: Request):
 
         logger.info(f"Sending email for: {user_email}")
 
+        try:
+            site = sites.sites[sites.resolve(data.get("site_id"), request.headers.get("x-api-key"))]
+        except UnknownSiteError as e:
+            return unknown_site_response(e)
+
         # Create EmailJS parameters
         template_params = {
-            "website_url": WEBSITE_URL,
+            "website_url": site["url"],
             "user_email": user_email,
             "user_query": message,
             "conversation": conversation,
@@ -1139,23 +3734,76 @@ async def send_email(request: Request):
 
 
 # Basic health check
+def site_health(site_manager: ChatbotManager) -> Dict[str, Any]:
+    return {
+        "website": site_manager.website_url,
+        "context_last_updated": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(
+            site_manager.last_scan_time)) if site_manager.last_scan_time else None,
+        "context_refreshing": site_manager.is_refreshing,
+        "crawler": CRAWLER_ENABLED and (site_manager.crawler_lock is None or site_manager.crawler_lock.held),
+        "sessions": site_manager.sessions.stats(),
+        "answer_cache": site_manager.answer_cache.stats()
+    }
+
+
 @app.get("/health")
 async def health_check():
-    return {
+    health = {
         "status": "healthy",
         "timestamp": time.time(),
-        "website": WEBSITE_URL,
-        "context_last_updated": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(
-            chatbot_manager.last_scan_time)) if chatbot_manager.last_scan_time else None
+        "startup": startup.stats(),
+        "sites": sites.stats(),
+        "query_pipeline": query_pipeline.stats(),
+        "llm_backend": LLM_BACKEND,
+        "email_queue": email_queue.stats(),
+        "parse_pool": parse_pool.stats(),
+        "shared_state": {"enabled": SHARED_STATE, "pid": os.getpid()}
     }
+    loaded = {site_manager.site_id: site_manager for site_manager in sites.loaded()}
+    if len(sites.sites) == 1:
+        # Single-site deployments report the site at the top level
+        site_id, site = next(iter(sites.sites.items()))
+        health["website"] = site["url"]
+        if site_id in loaded:
+            health.update(site_health(loaded[site_id]))
+    else:
+        health["loaded_sites"] = {site_id: site_health(site_manager) for site_id, site_manager in loaded.items()}
+    return health
+
+
+@app.get("/api/escalations/{escalation_id}")
+async def escalation_status(escalation_id: str):
+    """Delivery status of a queued escalation email"""
+    status = email_queue.status(escalation_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown escalation id"})
+    return status
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+startup.record("module", STARTUP_BEGAN)
 
 
 if __name__ == "__main__":
+
+    if sys.argv[1:2] == ["crawl"]:
+        # Separate crawl job for shared-state deployments: scan the given sites (default: all) once,
+        # write their snapshots and exit
+        for crawl_site_id in sys.argv[2:] or list(sites.sites):
+            sites.get(crawl_site_id).init_context()
+        sys.exit(0)
+
     # Get port from environment variable (for Railway deployment)
     port = int(os.environ.get("PORT", 8000))
 
+    # Pass the app object rather than "app:app", so the module is not imported a second time
     uvicorn.run(
-        "app:app",
+        app,
         host="0.0.0.0",
         port=port,
         log_level="info"
@@ -0,0 +1,501 @@
+# benchmark.py
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import deque
+from urllib.parse import urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+
+import app
+
+# Keep the per-page logging of app.py out of the benchmark output
+logging.getLogger("app").setLevel(logging.WARNING)
+log = logging.getLogger("benchmark")
+log.setLevel(logging.WARNING)
+
+
+def legacy_extract_text(html: str, url: str) -> tuple:
+    """The original two-parse, multi-select extractor, kept as the baseline"""
+    # Create BeautifulSoup object with the HTML parser explicitly specified
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Store original full HTML for link extraction
+    full_soup = BeautifulSoup(html, 'html.parser')  # Create a fresh copy instead of using .copy()
+
+    # First, remove elements that usually contain non-content
+    for selector in [
+        'script', 'style', 'noscript', 'iframe', 'img', 'svg',
+        '[class*="footer"]', '[class*="sidebar"]', '[class*="widget"]',
+        '[class*="banner"]', '[class*="ad-"]', '[id*="ad-"]'
+    ]:
+        for element in soup.select(selector):
+            if element:
+                element.decompose()
+
+    # Find the main content area if it exists
+    main_content = None
+    main_selectors = [
+        'main', 'article', '[role="main"]', '.content', '#content',
+        '.main', '#main', '.post', '.entry', '.page-content',
+        '[class*="content"]', '[id*="content"]'
+    ]
+
+    main_candidates = []
+    for selector in main_selectors:
+        elements = soup.select(selector)
+        if elements:
+            main_candidates.extend(elements)
+
+    if main_candidates:
+        try:
+            # Try to find the main content with the most text
+            main_content = max(main_candidates, key=lambda x: len(x.get_text(strip=True) or ""))
+        except (TypeError, ValueError) as e:
+            # If there's an error finding the main content, continue without it
+            log.warning(f"Error finding main content on {url}: {e}")
+            main_content = None
+
+    # If we found a main content area, use that, otherwise use the whole page
+    if main_content:
+        # Get text from just this section
+        content_soup = main_content
+        log.info(f"Found main content section on {url}")
+    else:
+        # Remove header/nav/footer before text extraction
+        content_soup = soup
+        for selector in ['header', 'nav', '[class*="nav"]', '[class*="menu"]', '[id*="menu"]']:
+            for element in content_soup.select(selector):
+                if element:
+                    element.decompose()
+        log.info(f"No main content section found, using full page for {url}")
+
+    # Get text with spacing to maintain structure - safely
+    text = ""
+    for tag_name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'li', 'div']:
+        for element in content_soup.find_all(tag_name):
+            try:
+                element_text = element.get_text(strip=True)
+                if element_text:
+                    if tag_name.startswith('h'):
+                        text += f"\n\n{element_text}\n\n"
+                    elif tag_name == 'p':
+                        text += f"{element_text}\n\n"
+                    elif tag_name == 'li':
+                        text += f"• {element_text}\n"
+                    else:
+                        text += f"{element_text} "
+            except Exception as e:
+                log.error(f"Error extracting text from {tag_name} element: {e}")
+                continue
+
+    # Clean text
+    lines = [line.strip() for line in text.splitlines()]
+    chunks = []
+    for line in lines:
+        line_chunks = [phrase.strip() for phrase in line.split("  ")]
+        chunks.extend(line_chunks)
+    text = ' '.join(chunk for chunk in chunks if chunk)
+
+    # Remove extra spacing
+    text = ' '.join(text.split())
+
+    # Add page title at the beginning for context - safely
+    title = url
+    if soup.title:
+        title_text = soup.title.string
+        if title_text:
+            title = title_text
+
+    text = f"PAGE TITLE: {title}\n\n{text}"
+
+    # Add any visible meta descriptions - safely
+    meta_desc = soup.find('meta', attrs={'name': 'description'})
+    if meta_desc and meta_desc.has_attr('content'):
+        meta_content = meta_desc['content']
+        if meta_content:
+            text = f"{text}\n\nMETA DESCRIPTION: {meta_content}"
+
+    return text, full_soup
+
+
+def legacy_extract_page(html: str, url: str) -> tuple:
+    """Baseline text and link extraction, as done by the crawler before the single-pass extractor"""
+    text, full_soup = legacy_extract_text(html, url)
+    hrefs = [a_tag.get('href', '') for a_tag in full_soup.find_all('a', href=True)] if full_soup else []
+    return text, hrefs
+
+
+def legacy_analyze_sentiment(query: str) -> str:
+    """The original sentiment check: one substring scan per indicator"""
+    query_lower = query.lower()
+    if any(indicator in query_lower for indicator in ["asap", "urgent", "immediately", "emergency", "right now", "hurry", "quickly"]):
+        return "urgent"
+    if any(indicator in query_lower for indicator in ["not working", "doesn't work", "doesn't help", "unhelpful", "frustrated",
+                                                      "annoying", "useless", "waste", "terrible", "awful", "stupid"]) or "!" in query:
+        return "frustrated"
+    if any(indicator in query_lower for indicator in ["don't understand", "confused", "unclear", "what do you mean", "how does",
+                                                      "explain"]) or "?" in query:
+        return "confused"
+    if any(indicator in query_lower for indicator in ["thanks", "thank you", "great", "awesome", "excellent", "helpful", "good"]):
+        return "happy"
+    if any(query_lower.startswith(indicator) for indicator in ["how", "what", "where", "when", "why", "who", "can you", "is there", "tell me"]):
+        return "curious"
+    return "neutral"
+
+
+def legacy_escalation_signals(query: str, previous_queries: list) -> dict:
+    """The original escalation checks: keyword scans, uncompiled regexes and Jaccard over re-split queries"""
+    frustration_patterns = [r'\?{2,}', r'\!{2,}', r'[A-Z]{3,}', r'\bWHY\b', r'\bNOT\b', r'\bCAN\'T\b', r'\bHELP\b']
+    email = None
+    if "@" in query and "." in query.split("@")[1]:
+        email_matches = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', query)
+        if email_matches:
+            email = email_matches[0]
+
+    def similarity(text1, text2):
+        words1, words2 = set(text1.lower().split()), set(text2.lower().split())
+        if not words1 or not words2:
+            return 0.0
+        return len(words1 & words2) / len(words1 | words2)
+
+    query_lower = query.lower()
+    return {
+        "email": email,
+        "repeated_question": any(similarity(query_lower, prev.lower()) > 0.7 for prev in previous_queries[-3:]),
+        "escalation_keyword": any(keyword in query_lower for keyword in app.MessageClassifier.ESCALATION_KEYWORDS),
+        "frustration_pattern": any(re.search(pattern, query) for pattern in frustration_patterns)
+    }
+
+
+def legacy_preprocessor() -> tuple:
+    """Stopwords and lemmatizer of the original preprocessing, from local NLTK data if any (never downloaded).
+    Returns (stop_words, lemmatize, lemmatizer name)"""
+    try:
+        from nltk.corpus import stopwords
+        stop_words = frozenset(stopwords.words('english'))
+    except (ImportError, LookupError):
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+        stop_words = frozenset(ENGLISH_STOP_WORDS)
+    try:
+        from nltk.stem import WordNetLemmatizer
+        lemmatize = WordNetLemmatizer().lemmatize
+        lemmatize("warm up")  # Loads WordNet, raises LookupError without the data
+        return stop_words, lemmatize, "WordNet"
+    except (ImportError, LookupError):
+        return stop_words, lambda word: word, "none (NLTK WordNet data missing, words kept as-is)"
+
+
+def legacy_preprocess_text(text: str, stop_words: frozenset, lemmatize) -> str:
+    """The original preprocessing, run on every crawled page: one lemmatizer call per word occurrence"""
+    return ' '.join(lemmatize(word) for word in text.lower().split() if word not in stop_words)
+
+
+def sample_messages(count: int, seed: int = 0) -> list:
+    """Synthetic chat messages mixing questions, complaints, escalation requests and emails"""
+    rng = random.Random(seed)
+    openers = ["", "Hi, ", "Hello! ", "Thanks, ", "OK so ", "URGENT: ", "Sorry, "]
+    bodies = [
+        "what services do you offer", "how does the pricing work", "where are you located",
+        "this is not working at all", "I don't understand the refund policy", "can you help me with my order",
+        "I want to speak to a human", "your answers are useless", "tell me about shipping times",
+        "is there a discount for students", "please email me at jane.doe@example.com",
+        "the website is great, thank you", "why is my account locked", "I need this fixed right now",
+        "can I talk to a representative about an incorrect invoice", "what do you mean by that",
+    ]
+    endings = ["", "?", "??", "!", "!!!", ".", " please", " asap"]
+    return [rng.choice(openers) + rng.choice(bodies) + rng.choice(endings) for _ in range(count)]
+
+
+def benchmark_classifier(args):
+    """Compare per-message cost of the legacy keyword scans and the compiled classifier"""
+    messages = sample_messages(args.messages)
+    history = messages[:3]
+    classifier = app.MessageClassifier()
+
+    def legacy():
+        return [(legacy_analyze_sentiment(m), legacy_escalation_signals(m, history)) for m in messages]
+
+    history_words = [frozenset(m.lower().split()) for m in history]
+
+    def compiled():
+        results = []
+        for m in messages:
+            signals = classifier.classify(m)
+            repeated = any(app.jaccard_similarity(signals["words"], words) > 0.7 for words in history_words)
+            results.append((signals, repeated))
+        return results
+
+    def batch():
+        return classifier.classify_many(messages)
+
+    # Plain wall time: tracing allocations would dominate at this scale
+    timings = {}
+    for name, func in [("legacy", legacy), ("compiled", compiled), ("batch", batch)]:
+        runs = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - start)
+        timings[name] = min(runs)
+
+    # The compiled classifier must agree with the original checks
+    mismatches = 0
+    batch_results = batch()
+    for message, batch_signals in zip(messages, batch_results):
+        signals = classifier.classify(message)
+        legacy_signals = legacy_escalation_signals(message, history)
+        if (signals != batch_signals or signals["sentiment"] != legacy_analyze_sentiment(message)
+                or signals["email"] != legacy_signals["email"]
+                or signals["escalation_keyword"] != legacy_signals["escalation_keyword"]
+                or signals["frustration_pattern"] != legacy_signals["frustration_pattern"]):
+            mismatches += 1
+
+    per_message = {name: seconds / len(messages) * 1e6 for name, seconds in timings.items()}
+    if args.json:
+        print(json.dumps({"messages": len(messages), "per_message_us": per_message, "mismatches": mismatches}, indent=2))
+        return
+
+    print(f"{len(messages)} messages, best of {args.repeat} runs")
+    for name, microseconds in per_message.items():
+        print(f"{name:<10} {microseconds:>8.1f} us/message  ({per_message['legacy'] / microseconds:.1f}x)")
+    print(f"Mismatches against the legacy checks: {mismatches}")
+
+
+def measure(func, *args) -> dict:
+    """Run func once and return its wall time and peak traced memory"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"result": result, "seconds": elapsed, "peak_bytes": peak}
+
+
+def save_pages(args):
+    """Download pages of a website into a directory, to benchmark against a fixed set"""
+    os.makedirs(args.out, exist_ok=True)
+    extractor = app.HTMLExtractor()
+    domain = urlparse(args.url).netloc
+    queue = deque([args.url])
+    seen = {args.url}
+    saved = 0
+
+    while queue and saved < args.max_pages:
+        url = queue.popleft()
+        try:
+            response = requests.get(url, headers=app.CRAWL_HEADERS, timeout=app.CRAWL_REQUEST_TIMEOUT)
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Skipping {url}: {e}")
+            continue
+
+        saved += 1
+        with open(os.path.join(args.out, f"page-{saved:03d}.html"), "w", encoding="utf-8") as f:
+            f.write(f"<!-- {url} -->\n{response.text}")
+
+        for href in extractor.extract(response.text, url)[1]:
+            link = urljoin(url, href).split('#')[0]
+            if urlparse(link).netloc == domain and link not in seen:
+                seen.add(link)
+                queue.append(link)
+
+    print(f"Saved {saved} pages to {args.out}")
+
+
+def load_pages(directory: str) -> list:
+    """Load saved pages as (name, url, html) tuples"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            html = f.read()
+        url = html[5:html.index(" -->")] if html.startswith("<!-- ") else path
+        pages.append((os.path.basename(path), url, html))
+    return pages
+
+
+def benchmark_extraction(args):
+    """Compare per-page parse time and peak memory of the legacy and single-pass extractors"""
+    pages = load_pages(args.pages)
+    if not pages:
+        print(f"No .html files found in {args.pages}. Save some first with: python benchmark.py save-pages --url URL")
+        return
+
+    extractor = app.HTMLExtractor()
+    rows = []
+    for name, url, html in pages:
+        legacy = min((measure(legacy_extract_page, html, url) for _ in range(args.repeat)), key=lambda m: m["seconds"])
+        single = min((measure(extractor.extract, html, url) for _ in range(args.repeat)), key=lambda m: m["seconds"])
+        rows.append({
+            "page": name,
+            "html_bytes": len(html),
+            "legacy_ms": legacy["seconds"] * 1000,
+            "single_pass_ms": single["seconds"] * 1000,
+            "legacy_peak_kb": legacy["peak_bytes"] / 1024,
+            "single_pass_peak_kb": single["peak_bytes"] / 1024,
+            "legacy_text_chars": len(legacy["result"][0]),
+            "single_pass_text_chars": len(single["result"][0])
+        })
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'page':<20} {'legacy ms':>10} {'single ms':>10} {'legacy KB':>10} {'single KB':>10} {'legacy chars':>13} {'single chars':>13}")
+    for row in rows:
+        print(f"{row['page']:<20} {row['legacy_ms']:>10.1f} {row['single_pass_ms']:>10.1f} "
+              f"{row['legacy_peak_kb']:>10.0f} {row['single_pass_peak_kb']:>10.0f} "
+              f"{row['legacy_text_chars']:>13} {row['single_pass_text_chars']:>13}")
+
+    total_legacy = sum(row["legacy_ms"] for row in rows)
+    total_single = sum(row["single_pass_ms"] for row in rows)
+    print(f"\nTotal: legacy {total_legacy:.0f} ms, single-pass {total_single:.0f} ms "
+          f"({total_legacy / total_single:.1f}x faster)")
+    print(f"Mean peak memory: legacy {sum(r['legacy_peak_kb'] for r in rows) / len(rows):.0f} KB, "
+          f"single-pass {sum(r['single_pass_peak_kb'] for r in rows) / len(rows):.0f} KB")
+
+
+def benchmark_preprocess(args):
+    """Time the stopword removal and lemmatization every scan used to run on every page, and no longer does"""
+    pages = load_pages(args.pages)
+    if not pages:
+        print(f"No .html files found in {args.pages}. Save some first with: python benchmark.py save-pages --url URL")
+        return
+
+    extractor = app.HTMLExtractor()
+    texts = [extractor.extract(html, url)[0] for _, url, html in pages]
+    # Loading the NLTK data is not part of the measurement
+    stop_words, lemmatize, lemmatizer = legacy_preprocessor()
+
+    runs = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for text in texts:
+            legacy_preprocess_text(text, stop_words, lemmatize)
+        runs.append(time.perf_counter() - start)
+    legacy = min(runs)
+
+    words = sum(len(text.split()) for text in texts)
+    result = {
+        "pages": len(texts),
+        "words": words,
+        "lemmatizer": lemmatizer,
+        "scan_seconds_saved": legacy
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"{len(texts)} pages, {words} words (lemmatizer: {lemmatizer}), best of {args.repeat} runs")
+    print(f"Scan time saved by no longer preprocessing the pages: {legacy * 1000:.1f} ms per scan")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def benchmark_startup(args):
+    """Time from launching the server to its first healthy /health response (cold start)"""
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    env = dict(os.environ, LLM_BACKEND=os.getenv("LLM_BACKEND", "mock"))
+    if args.url:
+        env["WEBSITE_URL"] = args.url
+
+    runs = []
+    for _ in range(args.runs):
+        port = free_port()
+        env["PORT"] = str(port)
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, app_path], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            health = None
+            while time.perf_counter() - start < args.timeout:
+                if server.poll() is not None:
+                    sys.exit(f"Server exited with code {server.returncode} before becoming healthy")
+                try:
+                    response = requests.get(f"http://127.0.0.1:{port}/health", timeout=1)
+                    if response.ok:
+                        health = response.json()
+                        break
+                except requests.RequestException:
+                    pass
+                time.sleep(0.02)
+            if health is None:
+                sys.exit(f"Server was not healthy after {args.timeout}s")
+            runs.append({"seconds": time.perf_counter() - start, "phases": health.get("startup", {}).get("phases", {})})
+        finally:
+            server.terminate()
+            server.wait()
+
+    seconds = [run["seconds"] for run in runs]
+    median = statistics.median(seconds)
+    result = {"runs": len(runs), "median_seconds": median, "min_seconds": min(seconds), "max_seconds": max(seconds),
+              "budget_seconds": args.budget, "within_budget": median <= args.budget, "phases": runs[-1]["phases"]}
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"Cold start to first healthy response over {len(runs)} runs: median {median:.2f}s, "
+              f"min {min(seconds):.2f}s, max {max(seconds):.2f}s (budget {args.budget:.2f}s)")
+        print("Phases reported by the server: " + ", ".join(f"{name} {value:.2f}s" for name, value in result["phases"].items()))
+    if not result["within_budget"]:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the Context-Aware Website Chatbot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    save_parser = subparsers.add_parser("save-pages", help="Download pages of a website for offline benchmarks")
+    save_parser.add_argument("--url", default=app.WEBSITE_URL, help="Website to download (default: WEBSITE_URL)")
+    save_parser.add_argument("--out", default="saved_pages", help="Output directory (default: saved_pages)")
+    save_parser.add_argument("--max-pages", type=int, default=30, help="Maximum pages to save (default: 30)")
+    save_parser.set_defaults(func=save_pages)
+
+    extract_parser = subparsers.add_parser("extract", help="Compare the legacy and single-pass HTML extractors")
+    extract_parser.add_argument("--pages", default="saved_pages", help="Directory of saved .html pages (default: saved_pages)")
+    extract_parser.add_argument("--repeat", type=int, default=3, help="Runs per page, the fastest is kept (default: 3)")
+    extract_parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    extract_parser.set_defaults(func=benchmark_extraction)
+
+    classify_parser = subparsers.add_parser("classify", help="Compare the legacy and compiled message classifiers")
+    classify_parser.add_argument("--messages", type=int, default=10000, help="Synthetic messages to classify (default: 10000)")
+    classify_parser.add_argument("--repeat", type=int, default=3, help="Runs, the fastest is kept (default: 3)")
+    classify_parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    classify_parser.set_defaults(func=benchmark_classifier)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="Time the text preprocessing scans no longer run")
+    preprocess_parser.add_argument("--pages", default="saved_pages", help="Directory of saved .html pages (default: saved_pages)")
+    preprocess_parser.add_argument("--repeat", type=int, default=3, help="Runs, the fastest is kept (default: 3)")
+    preprocess_parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    preprocess_parser.set_defaults(func=benchmark_preprocess)
+
+    startup_parser = subparsers.add_parser("startup", help="Measure cold start to the first healthy /health response")
+    startup_parser.add_argument("--runs", type=int, default=5, help="Server launches, the median is reported (default: 5)")
+    startup_parser.add_argument("--budget", type=float, default=app.STARTUP_BUDGET_SECONDS,
+                                help="Fail if the median exceeds this many seconds (default: STARTUP_BUDGET_SECONDS)")
+    startup_parser.add_argument("--timeout", type=float, default=60, help="Give up on a launch after this many seconds (default: 60)")
+    startup_parser.add_argument("--url", help="Website the server loads (default: WEBSITE_URL)")
+    startup_parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    startup_parser.set_defaults(func=benchmark_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
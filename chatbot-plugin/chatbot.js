@@ -204,7 +204,9 @@ jQuery(document).ready(function($) {
                 type: 'POST',
                 contentType: 'application/json',
                 data: JSON.stringify({
-                    query: message
+                    query: message,
+                    conversation_id: conversationId,
+                    site_id: luxe_chatbot_params.site_id || null
                 }),
                 success: function(response) {
                     console.log('Luxe Chatbot: API response received:', response);
@@ -83,6 +83,7 @@ class Luxe_Chatbot {
             'luxe_chatbot_params',
             array(
                 'api_url' => LUXE_CHATBOT_API_URL,
+                'site_id' => get_option('luxe_chatbot_site_id', ''),
                 'debug' => true, // Enable debug mode for console logging
                 'plugin_url' => LUXE_CHATBOT_PLUGIN_URL,
                 'site_url' => site_url(),
@@ -315,6 +316,7 @@ class Luxe_Chatbot {
         register_setting('luxe-chatbot-settings-group', 'luxe_chatbot_color_secondary');
         register_setting('luxe-chatbot-settings-group', 'luxe_chatbot_chatbot_name');
         register_setting('luxe-chatbot-settings-group', 'luxe_chatbot_position');
+        register_setting('luxe-chatbot-settings-group', 'luxe_chatbot_site_id');
     }
 
     /**
@@ -327,6 +329,7 @@ class Luxe_Chatbot {
         $position = get_option('luxe_chatbot_position', 'right');
         $primary_color = get_option('luxe_chatbot_color_primary', '#0077b6');
         $secondary_color = get_option('luxe_chatbot_color_secondary', '#FFFFFF');
+        $site_id = get_option('luxe_chatbot_site_id', '');
         
         // Get dashboard URL
         $access_key = get_option('luxe_chatbot_dashboard_key', '');
@@ -364,6 +367,14 @@ class Luxe_Chatbot {
                         </td>
                     </tr>
                     
+                    <tr>
+                        <th scope="row">Site ID</th>
+                        <td>
+                            <input type="text" name="luxe_chatbot_site_id" value="<?php echo esc_attr($site_id); ?>" class="regular-text">
+                            <p class="description">Only needed when the chatbot server hosts several websites. Must match a site_id in the server's SITES_FILE.</p>
+                        </td>
+                    </tr>
+                    
                     <tr>
                         <th scope="row">Position</th>
                         <td>
@@ -3,6 +3,10 @@ import requests
 import json
 import argparse
 import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import websockets
 from colorama import Fore, Style, init
 
 # Initialize colorama
@@ -82,16 +86,224 @@ class ChatbotTestClient:
         print(f"{Fore.CYAN}=== Session Ended ===")
 
 
+# Scripted multi-turn dialogs replayed by the load generator
+LOAD_TEST_DIALOGS = [
+    ["What services do you offer?", "How much does it cost?", "Thanks, that helps!"],
+    ["How can I contact you?", "What are your opening hours?"],
+    ["Tell me about your company", "Where are you located?", "Do you ship internationally?"],
+    ["What is your refund policy?"],
+]
+
+# Escalation flows send real notification emails, so they only run with --escalation
+ESCALATION_DIALOGS = [
+    ["This isn't working, I want to speak to a human", "You can reach me at loadtest+{conversation}@example.com"],
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values),
+        "max": max(values)
+    }
+
+
+class LoadTester:
+    """Runs concurrent scripted conversations against /api/query and /ws/{client_id}"""
+
+    def __init__(self, server_url, conversations=10, transport="both", stream=False,
+                 escalation=False, think_time=0.0):
+        self.server_url = server_url.rstrip('/')
+        self.ws_url = self.server_url.replace("https://", "wss://").replace("http://", "ws://")
+        self.conversations = conversations
+        self.transport = transport
+        self.stream = stream
+        self.think_time = think_time
+        self.dialogs = LOAD_TEST_DIALOGS + (ESCALATION_DIALOGS if escalation else [])
+        self.samples = []
+        # requests is blocking, so HTTP conversations run on their own threads
+        self.executor = ThreadPoolExecutor(max_workers=max(1, conversations))
+
+    def _transport_for(self, index):
+        if self.transport == "both":
+            return "http" if index % 2 == 0 else "ws"
+        return self.transport
+
+    def _record(self, transport, start, ok, error=None, first_token=None):
+        sample = {"transport": transport, "latency": time.perf_counter() - start, "ok": ok, "error": error}
+        if first_token is not None:
+            sample["time_to_first_token"] = first_token - start
+        self.samples.append(sample)
+
+    async def _http_conversation(self, conversation_id, dialog):
+        loop = asyncio.get_running_loop()
+        session = requests.Session()
+        try:
+            for query in dialog:
+                start = time.perf_counter()
+                try:
+                    response = await loop.run_in_executor(self.executor, lambda q=query: session.post(
+                        f"{self.server_url}/api/query", json={"query": q, "conversation_id": conversation_id},
+                        timeout=120))
+                    data = response.json()
+                    if response.status_code == 503:
+                        self._record("http", start, False, "overloaded")
+                    elif response.status_code != 200 or data.get("error"):
+                        self._record("http", start, False, data.get("error") or f"http_{response.status_code}")
+                    else:
+                        self._record("http", start, True)
+                except Exception as e:
+                    self._record("http", start, False, type(e).__name__)
+                await asyncio.sleep(self.think_time)
+        finally:
+            session.close()
+
+    async def _ws_conversation(self, conversation_id, dialog):
+        try:
+            websocket = await websockets.connect(f"{self.ws_url}/ws/{conversation_id}")
+        except Exception as e:
+            for _ in dialog:
+                self._record("ws", time.perf_counter(), False, type(e).__name__)
+            return
+
+        async with websocket:
+            for query in dialog:
+                start = time.perf_counter()
+                first_token = None
+                try:
+                    await websocket.send(json.dumps({
+                        "type": "query", "query": query, "conversation_id": conversation_id, "stream": self.stream
+                    }))
+                    while True:
+                        message = json.loads(await websocket.recv())
+                        if message.get("type") == "error":
+                            self._record("ws", start, False, message.get("error", "error"))
+                            break
+                        if message.get("type") == "chunk":
+                            if first_token is None:
+                                first_token = time.perf_counter()
+                            continue
+                        if self.stream and message.get("type") != "done":
+                            continue
+                        # A "done" frame, or the complete response when not streaming
+                        if message.get("error"):
+                            self._record("ws", start, False, message["error"], first_token)
+                        else:
+                            self._record("ws", start, True, first_token=first_token)
+                        break
+                except Exception as e:
+                    self._record("ws", start, False, type(e).__name__)
+                await asyncio.sleep(self.think_time)
+
+    async def _conversation(self, index):
+        conversation_id = f"loadtest-{uuid.uuid4().hex[:12]}"
+        dialog = [query.format(conversation=conversation_id) for query in self.dialogs[index % len(self.dialogs)]]
+        if self._transport_for(index) == "http":
+            await self._http_conversation(conversation_id, dialog)
+        else:
+            await self._ws_conversation(conversation_id, dialog)
+
+    def report(self, duration):
+        """Throughput, latency percentiles and error rates, overall and per transport"""
+        def summarize(samples):
+            errors = {}
+            for sample in samples:
+                if not sample["ok"]:
+                    errors[sample["error"]] = errors.get(sample["error"], 0) + 1
+            summary = {
+                "requests": len(samples),
+                "errors": sum(errors.values()),
+                "error_rate": sum(errors.values()) / len(samples) if samples else 0.0,
+                "errors_by_type": errors,
+                "throughput": len(samples) / duration if duration else 0.0,
+                "latency": latency_summary([s["latency"] for s in samples if s["ok"]])
+            }
+            first_tokens = [s["time_to_first_token"] for s in samples if s.get("time_to_first_token") is not None]
+            if first_tokens:
+                summary["time_to_first_token"] = latency_summary(first_tokens)
+            return summary
+
+        by_transport = {}
+        for sample in self.samples:
+            by_transport.setdefault(sample["transport"], []).append(sample)
+
+        return {
+            "server": self.server_url,
+            "timestamp": time.time(),
+            "config": {
+                "conversations": self.conversations,
+                "transport": self.transport,
+                "stream": self.stream,
+                "think_time": self.think_time,
+                "dialogs": len(self.dialogs)
+            },
+            "duration": duration,
+            "overall": summarize(self.samples),
+            "transports": {name: summarize(samples) for name, samples in by_transport.items()}
+        }
+
+    async def run(self):
+        start = time.perf_counter()
+        await asyncio.gather(*(self._conversation(i) for i in range(self.conversations)))
+        duration = time.perf_counter() - start
+        self.executor.shutdown(wait=False)
+        return self.report(duration)
+
+
+def print_load_report(report):
+    print(f"{Fore.CYAN}=== Load Test: {report['config']['conversations']} conversations, {report['duration']:.2f}s ===")
+    for name, summary in [("overall", report["overall"])] + sorted(report["transports"].items()):
+        latency = summary["latency"]
+        color = Fore.GREEN if summary["errors"] == 0 else Fore.RED
+        print(f"{color}{name:>8}: {summary['requests']} requests, {summary['throughput']:.1f} req/s, "
+              f"errors {summary['error_rate']:.1%}")
+        if latency["p50"] is not None:
+            print(f"{Fore.WHITE}          latency p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  "
+                  f"p99 {latency['p99']:.3f}s")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Test client for the Context-Aware Website Chatbot")
     parser.add_argument("--server", default="http://localhost:8000", help="Server URL (default: http://localhost:8000)")
     parser.add_argument("--query", help="Query to send (bypasses interactive mode)")
+    parser.add_argument("--load", type=int, metavar="N", help="Run a load test with N concurrent conversations")
+    parser.add_argument("--transport", choices=["http", "ws", "both"], default="both",
+                        help="Load test transport (default: both, alternating per conversation)")
+    parser.add_argument("--stream", action="store_true", help="Stream WebSocket responses during the load test")
+    parser.add_argument("--escalation", action="store_true",
+                        help="Include escalation dialogs in the load test (sends notification emails)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between turns of a conversation")
+    parser.add_argument("--output", help="Write the load test report as JSON to this file")
 
     args = parser.parse_args()
 
     client = ChatbotTestClient(args.server)
 
-    if args.query:
+    if args.load:
+        # Load test mode
+        if not client.check_server_health():
+            return
+        tester = LoadTester(args.server, args.load, args.transport, args.stream, args.escalation, args.think_time)
+        report = asyncio.run(tester.run())
+        print_load_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"{Fore.CYAN}Report written to {args.output}")
+    elif args.query:
         # Non-interactive mode
         if client.check_server_health():
             client.send_query(args.query)